@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "BAAI/bge-m3"
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def load_model(
+    backend: str = "torch", threads: int = 0, model_name: str = MODEL_NAME
+) -> SentenceTransformer:
+    """
+    torch - fp32 PyTorch, int8 - PyTorch with dynamically quantized Linear
+    layers, onnx - ONNX Runtime on CPU. threads=0 keeps the library default.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    if backend == "onnx":
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        return SentenceTransformer(
+            model_name,
+            device="cpu",
+            backend="onnx",
+            model_kwargs={
+                "provider": "CPUExecutionProvider",
+                "session_options": session_options,
+            },
+        )
+
+    import torch
+
+    if threads:
+        torch.set_num_threads(threads)
+        os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    model.eval()
+    return model
+
+
+def to_output_dim(vectors: np.ndarray, dim: int) -> np.ndarray:
+    if vectors.shape[1] >= dim:
+        return vectors[:, :dim]
+    padded_vectors = np.zeros((vectors.shape[0], dim), dtype=vectors.dtype)
+    padded_vectors[:, : vectors.shape[1]] = vectors
+    return padded_vectors
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+
+class BatcherMetrics:
+    def __init__(self, max_batch: int, name: str = "embed") -> None:
+        self.name = name
+        self.buckets: List[int] = []
+        bound = 1
+        while bound < max_batch:
+            self.buckets.append(bound)
+            bound *= 2
+        self.buckets.append(max_batch)
+        self.batch_counts = [0] * (len(self.buckets) + 1)
+        self.batch_size_sum = 0
+        self.batches = 0
+        self.requests = 0
+        self.encode_seconds = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def observe_batch(self, size: int, requests: int, seconds: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if size <= bound:
+                self.batch_counts[i] += 1
+                break
+        else:
+            self.batch_counts[-1] += 1
+        self.batch_size_sum += size
+        self.batches += 1
+        self.requests += requests
+        self.encode_seconds += seconds
+
+    def render(self) -> str:
+        name = self.name
+        lines = [
+            f"# TYPE {name}_queue_depth gauge",
+            f"{name}_queue_depth {self.queue_depth}",
+            f"# TYPE {name}_queue_depth_max gauge",
+            f"{name}_queue_depth_max {self.max_queue_depth}",
+            f"# TYPE {name}_batch_size histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.batch_counts):
+            cumulative += count
+            lines.append(f'{name}_batch_size_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += self.batch_counts[-1]
+        lines += [
+            f'{name}_batch_size_bucket{{le="+Inf"}} {cumulative}',
+            f"{name}_batch_size_sum {self.batch_size_sum}",
+            f"{name}_batch_size_count {self.batches}",
+            f"# TYPE {name}_requests_total counter",
+            f"{name}_requests_total {self.requests}",
+            f"# TYPE {name}_encode_seconds_total counter",
+            f"{name}_encode_seconds_total {self.encode_seconds:.6f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MicroBatcher:
+    """
+    Collects texts from concurrent requests for up to max_wait_ms or max_batch
+    texts, encodes them with one call and scatters the rows back.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], Sequence],
+        max_batch: int = 64,
+        max_wait_ms: float = 5.0,
+        name: str = "embed",
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> None:
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = BatcherMetrics(max_batch, name)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Модель вызывается из одного потока, event loop остаётся свободным.
+        # Батчеры одной модели передают общий executor
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="encode"
+        )
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def submit(self, texts: List[str]) -> Sequence:
+        if self._queue is None:
+            raise RuntimeError("MicroBatcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        self.metrics.queue_depth += len(texts)
+        self.metrics.max_queue_depth = max(
+            self.metrics.max_queue_depth, self.metrics.queue_depth
+        )
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[List[str], asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        size = len(items[0][0])
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            texts = [text for batch, _ in items for text in batch]
+            self.metrics.queue_depth -= len(texts)
+            started = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(self._executor, self.encode, texts)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics.observe_batch(
+                len(texts), len(items), time.perf_counter() - started
+            )
+            offset = 0
+            for batch, future in items:
+                if not future.done():
+                    future.set_result(vectors[offset : offset + len(batch)])
+                offset += len(batch)
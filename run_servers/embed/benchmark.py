@@ -0,0 +1,84 @@
+"""
+Throughput benchmark of the embedding server encode path on data/data_split.
+
+Three modes are compared on the same requests of --batch texts:
+    unsorted - fixed-size sub-batches of MAX_BATCH in arrival order, no sorting
+    plain    - the server with EMBED_LENGTH_BUCKETING=0: one model.encode call,
+               which already sorts the texts by length inside the call
+    bucketed - the server with length bucketing under EMBED_TOKEN_BUDGET
+
+Usage (from run_servers/embed):
+    python benchmark.py --data ../../data/data_split --limit 2000
+"""
+
+import argparse
+import random
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+
+def load_corpus(data: Path, limit: int, seed: int) -> List[str]:
+    # Смесь как при индексации и на запросах: чанки по 250 слов и короткие фразы
+    texts: List[str] = []
+    for file_path in sorted(data.rglob("*.*")):
+        words = file_path.read_text(encoding="utf-8", errors="ignore").split()
+        for start in range(0, len(words), 200):
+            texts.append(" ".join(words[start : start + 250]))
+            texts.append(
+                " ".join(words[start : start + random.Random(start).randint(3, 12)])
+            )
+    random.Random(seed).shuffle(texts)
+    return texts[:limit]
+
+
+def measure(
+    name: str, encode: Callable[[List[str]], np.ndarray], texts: List[str], batch: int
+) -> float:
+    encode(texts[:batch])
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch):
+        encode(texts[i : i + batch])
+    elapsed = time.perf_counter() - started
+    rate = len(texts) / elapsed
+    print(f"{name:>12}: {len(texts)} texts in {elapsed:.1f}s, {rate:.1f} texts/s")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=Path, default=Path("../../data/data_split"))
+    parser.add_argument("--limit", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    import embedding_server as server
+
+    texts = load_corpus(args.data, args.limit, args.seed)
+
+    def encode_unsorted(batch: List[str]) -> np.ndarray:
+        # Один прямой проход на подбатч: внутренняя сортировка
+        # sentence-transformers ничего не меняет в пределах одного батча
+        return np.concatenate(
+            [
+                server.encode_batch(batch[i : i + server.MAX_BATCH])
+                for i in range(0, len(batch), server.MAX_BATCH)
+            ]
+        )
+
+    unsorted = measure("unsorted", encode_unsorted, texts, args.batch)
+    server.LENGTH_BUCKETING = False
+    plain = measure("plain", server.encode, texts, args.batch)
+    server.LENGTH_BUCKETING = True
+    bucketed = measure("bucketed", server.encode, texts, args.batch)
+    print(
+        f"bucketed speedup: {bucketed / unsorted:.2f}x over unsorted, "
+        f"{bucketed / plain:.2f}x over plain (length-sorted)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from typing import Any, Callable, List, Sequence
+
+import numpy as np
+
+
+def length_class(length: int, min_length: int = 16) -> int:
+    bound = min_length
+    while bound < length:
+        bound *= 2
+    return bound
+
+
+def length_buckets(
+    lengths: List[int], token_budget: int, max_batch: int
+) -> List[List[int]]:
+    """
+    Groups text indices into buckets of similar tokenized length (powers of two).
+    Every bucket is padded to its longest text, so a bucket holds as many texts
+    as fit into token_budget.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets: List[List[int]] = []
+    current: List[int] = []
+    current_class = 0
+    for i in order:
+        # Тексты отсортированы по возрастанию, текущий задаёт длину паддинга
+        padded = (len(current) + 1) * max(lengths[i], 1)
+        if current and (
+            length_class(lengths[i]) != current_class
+            or padded > token_budget
+            or len(current) >= max_batch
+        ):
+            buckets.append(current)
+            current = []
+        if not current:
+            current_class = length_class(lengths[i])
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def encode_bucketed(
+    texts: List[str],
+    count_tokens: Callable[[List[str]], List[int]],
+    encode: Callable[[List[str]], Sequence],
+    token_budget: int,
+    max_batch: int,
+) -> Sequence:
+    buckets = length_buckets(count_tokens(texts), token_budget, max_batch)
+    parts = [(bucket, encode([texts[i] for i in bucket])) for bucket in buckets]
+    if parts and isinstance(parts[0][1], np.ndarray):
+        result = np.empty((len(texts), parts[0][1].shape[1]), dtype=parts[0][1].dtype)
+        for bucket, vectors in parts:
+            result[bucket] = vectors
+        return result
+    rows: List[Any] = [None] * len(texts)
+    for bucket, encoded in parts:
+        for i, row in zip(bucket, encoded):
+            rows[i] = row
+    return rows
@@ -0,0 +1,64 @@
+"""
+Parity and throughput of a CPU backend against fp32 PyTorch.
+
+Usage (from run_servers/embed):
+    python compare_backends.py --backend int8 --threads 8
+"""
+
+import argparse
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+from backends import BACKENDS, load_model, to_output_dim
+from benchmark import load_corpus, measure
+
+EMB_SIZE = 384
+
+
+def encoder(
+    backend: str, threads: int, batch: int
+) -> Callable[[List[str]], np.ndarray]:
+    model = load_model(backend, threads)
+
+    def encode(texts: List[str]) -> np.ndarray:
+        vectors = model.encode(texts, batch_size=batch, convert_to_numpy=True)
+        return to_output_dim(vectors, EMB_SIZE)
+
+    return encode
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=BACKENDS, default="int8")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--data", type=Path, default=Path("../../data/data_split"))
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.data, args.limit, args.seed)
+
+    reference = encoder("torch", args.threads, args.batch)
+    candidate = encoder(args.backend, args.threads, args.batch)
+
+    sims = cosine(reference(texts), candidate(texts))
+    print(
+        f"cosine vs fp32 ({len(texts)} texts): mean {sims.mean():.5f}, "
+        f"p1 {np.percentile(sims, 1):.5f}, min {sims.min():.5f}"
+    )
+
+    fp32 = measure("torch", reference, texts, args.batch)
+    other = measure(args.backend, candidate, texts, args.batch)
+    print(f"speedup: {other / fp32:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
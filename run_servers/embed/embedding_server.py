@@ -1,15 +1,124 @@
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator
+
 import numpy as np
 import uvicorn
-from fastapi import FastAPI
+from backends import load_model, to_output_dim
+from batcher import MicroBatcher
+from bucketing import encode_bucketed
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from prefork import serve_prefork
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
+from sparse import SparseHead
+
+MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+LENGTH_BUCKETING = os.getenv("EMBED_LENGTH_BUCKETING", "1") == "1"
+TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", "16384"))
+BACKEND = os.getenv("EMBED_BACKEND", "torch")
+THREADS = int(os.getenv("EMBED_THREADS", "0"))
+WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+HOST = os.getenv("EMBED_HOST", "0.0.0.0")
+PORT = int(os.getenv("EMBED_PORT", "8001"))
+SPARSE = os.getenv("EMBED_SPARSE", "1") == "1"
+
+if WORKERS > 1 and BACKEND == "onnx":
+    # Пул потоков сессии ONNX Runtime не переживает fork
+    raise SystemExit("EMBED_WORKERS > 1 is supported for torch and int8 backends")
+
+
+def worker_threads() -> int:
+    if THREADS or WORKERS <= 1:
+        return THREADS
+    # Ядра делятся между воркерами, иначе они вытесняют друг друга
+    return max((os.cpu_count() or 1) // WORKERS, 1)
 
-model = SentenceTransformer("BAAI/bge-m3")
 
-app = FastAPI()
+# Бинарный ответ: заголовок (magic, код dtype, строки, размерность),
+# затем матрица little-endian. Формат продублирован в EmbedClient
+BINARY_MAGIC = b"EMB1"
+BINARY_HEADER = struct.Struct("<4sIII")
+BINARY_FORMATS = {
+    "application/x-embeddings-f16": (2, np.dtype("<f2")),
+    "application/x-embeddings-f32": (1, np.dtype("<f4")),
+}
+
+# Веса загружаются до fork и разделяются воркерами
+model = load_model(BACKEND, worker_threads())
+sparse_head = SparseHead(model) if SPARSE else None
 emb_size = 384
 
 
+def count_tokens(texts: list[str]) -> list[int]:
+    encoded = model.tokenizer(
+        texts, truncation=True, max_length=model.max_seq_length, verbose=False
+    )
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+def encode_batch(texts: list[str]) -> np.ndarray:
+    return model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+
+
+def encode(texts: list[str]) -> np.ndarray:
+    if LENGTH_BUCKETING:
+        # Короткие запросы не паддятся до длины юридических чанков
+        vectors = encode_bucketed(
+            texts, count_tokens, encode_batch, TOKEN_BUDGET, MAX_BATCH
+        )
+    else:
+        vectors = model.encode(texts, batch_size=MAX_BATCH, convert_to_numpy=True)
+    return to_output_dim(vectors, emb_size)
+
+
+def encode_hybrid_batch(texts: list[str]) -> list[tuple[np.ndarray, dict]]:
+    return sparse_head.encode(model, texts)
+
+
+def encode_hybrid(texts: list[str]) -> list[tuple[np.ndarray, dict]]:
+    # Плотный вектор и лексические веса bge-m3 из одного прохода модели
+    if LENGTH_BUCKETING:
+        rows = encode_bucketed(
+            texts, count_tokens, encode_hybrid_batch, TOKEN_BUDGET, MAX_BATCH
+        )
+    else:
+        rows = []
+        for i in range(0, len(texts), MAX_BATCH):
+            rows.extend(encode_hybrid_batch(texts[i : i + MAX_BATCH]))
+    dense = to_output_dim(np.stack([vector for vector, _ in rows]), emb_size)
+    return [(dense[i], lexical) for i, (_, lexical) in enumerate(rows)]
+
+
+encode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+batcher = MicroBatcher(
+    encode, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, executor=encode_executor
+)
+hybrid_batcher = MicroBatcher(
+    encode_hybrid,
+    max_batch=MAX_BATCH,
+    max_wait_ms=MAX_WAIT_MS,
+    name="embed_hybrid",
+    executor=encode_executor,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    await batcher.start()
+    await hybrid_batcher.start()
+    yield
+    await batcher.stop()
+    await hybrid_batcher.stop()
+    encode_executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
 class EmbedRequest(BaseModel):
     texts: list[str]
 
@@ -18,17 +127,84 @@ class EmbedResponse(BaseModel):
     embeddings: list[list[float]]
 
 
+class SparseVector(BaseModel):
+    indices: list[int]
+    values: list[float]
+
+
+class HybridEmbedResponse(BaseModel):
+    embeddings: list[list[float]]
+    sparse: list[SparseVector]
+
+
+def binary_media_type(accept: str) -> str | None:
+    # Старые клиенты не присылают Accept с бинарным форматом и получают JSON
+    for media_type in BINARY_FORMATS:
+        if media_type in accept:
+            return media_type
+    return None
+
+
+def pack_matrix(vectors: np.ndarray, media_type: str) -> bytes:
+    code, dtype = BINARY_FORMATS[media_type]
+    data = np.ascontiguousarray(vectors, dtype=dtype)
+    header = BINARY_HEADER.pack(BINARY_MAGIC, code, data.shape[0], data.shape[1])
+    return header + data.tobytes()
+
+
+def pack_sparse(lexicals: list[dict]) -> bytes:
+    # Число ненулевых весов по строкам (uint32), затем все индексы (int32)
+    # и все веса (float32) подряд
+    nnz = np.array([len(lexical["indices"]) for lexical in lexicals], dtype="<u4")
+    indices = np.array(
+        [i for lexical in lexicals for i in lexical["indices"]], dtype="<i4"
+    )
+    values = np.array(
+        [v for lexical in lexicals for v in lexical["values"]], dtype="<f4"
+    )
+    return nnz.tobytes() + indices.tobytes() + values.tobytes()
+
+
 @app.post("/embed", response_model=EmbedResponse)
-def embed(req: EmbedRequest) -> EmbedResponse:
-    vectors = model.encode(req.texts, convert_to_numpy=True)
-    if vectors.shape[1] > emb_size:
-        truncated_vectors = vectors[:, :emb_size].tolist()
+async def embed(req: EmbedRequest, accept: str = Header("")) -> Response:
+    if req.texts:
+        vectors = await batcher.submit(req.texts)
     else:
-        padded_vectors = np.zeros((vectors.shape[0], emb_size))
-        padded_vectors[:, : vectors.shape[1]] = vectors
-        truncated_vectors = padded_vectors.tolist()
-    return EmbedResponse(embeddings=truncated_vectors)
+        vectors = np.zeros((0, emb_size), dtype=np.float32)
+    media_type = binary_media_type(accept)
+    if media_type is not None:
+        return Response(content=pack_matrix(vectors, media_type), media_type=media_type)
+    return EmbedResponse(embeddings=vectors.tolist())
+
+
+@app.post("/embed_hybrid", response_model=HybridEmbedResponse)
+async def embed_hybrid(req: EmbedRequest, accept: str = Header("")) -> Response:
+    if sparse_head is None:
+        raise HTTPException(status_code=501, detail="Sparse weights are disabled")
+    rows = await hybrid_batcher.submit(req.texts) if req.texts else []
+    media_type = binary_media_type(accept)
+    if media_type is not None:
+        if rows:
+            dense = np.stack([vector for vector, _ in rows])
+        else:
+            dense = np.zeros((0, emb_size), dtype=np.float32)
+        content = pack_matrix(dense, media_type) + pack_sparse(
+            [lexical for _, lexical in rows]
+        )
+        return Response(content=content, media_type=media_type)
+    return HybridEmbedResponse(
+        embeddings=[vector.tolist() for vector, _ in rows],
+        sparse=[SparseVector(**lexical) for _, lexical in rows],
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    return batcher.metrics.render() + hybrid_batcher.metrics.render()
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    if WORKERS > 1:
+        serve_prefork(app, HOST, PORT, WORKERS)
+    else:
+        uvicorn.run(app, host=HOST, port=PORT)
@@ -0,0 +1,59 @@
+import gc
+import os
+import signal
+import socket
+import sys
+
+import uvicorn
+from fastapi import FastAPI
+
+
+def serve_prefork(app: FastAPI, host: str, port: int, workers: int) -> None:
+    """
+    Runs `workers` uvicorn processes forked from the current one on a shared
+    listening socket. Everything loaded before the call (model weights) is
+    shared between workers copy-on-write instead of being loaded N times.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Сборщик мусора не трогает заголовки уже созданных объектов,
+    # поэтому страницы с весами не копируются в воркерах
+    gc.freeze()
+
+    children: list[int] = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            config = uvicorn.Config(app, host=host, port=port, workers=1)
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+    print(f"Started {workers} embedding workers: {children}", file=sys.stderr)
+
+    def stop(signum: int, _frame: object) -> None:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid in children:
+            children.remove(pid)
+            print(f"Worker {pid} exited with status {status}", file=sys.stderr)
+    sock.close()
@@ -0,0 +1,58 @@
+import numpy as np
+import torch
+from backends import MODEL_NAME
+from huggingface_hub import hf_hub_download
+from sentence_transformers import SentenceTransformer
+
+
+class SparseHead:
+    """
+    bge-m3 lexical weights: relu(sparse_linear(token_embedding)) for every
+    token, max-pooled per token id, special tokens excluded. Computed from the
+    same forward pass as the dense vector.
+    """
+
+    def __init__(
+        self, model: SentenceTransformer, model_name: str = MODEL_NAME
+    ) -> None:
+        state = torch.load(
+            hf_hub_download(model_name, "sparse_linear.pt"), map_location="cpu"
+        )
+        self.linear = torch.nn.Linear(state["weight"].shape[1], 1)
+        self.linear.load_state_dict(state)
+        self.linear.eval()
+        tokenizer = model.tokenizer
+        self.skip_ids = {
+            tokenizer.cls_token_id,
+            tokenizer.eos_token_id,
+            tokenizer.pad_token_id,
+            tokenizer.unk_token_id,
+        } - {None}
+
+    def encode(
+        self, model: SentenceTransformer, texts: list[str]
+    ) -> list[tuple[np.ndarray, dict]]:
+        rows = model.encode(texts, batch_size=len(texts), output_value=None)
+        result = []
+        with torch.inference_mode():
+            for row in rows:
+                token_embeddings = torch.as_tensor(row["token_embeddings"]).float()
+                weights = torch.relu(self.linear(token_embeddings)).squeeze(-1)
+                lexical: dict[int, float] = {}
+                for token_id, weight, attended in zip(
+                    torch.as_tensor(row["input_ids"]).tolist(),
+                    weights.tolist(),
+                    torch.as_tensor(row["attention_mask"]).tolist(),
+                ):
+                    if not attended or weight <= 0 or token_id in self.skip_ids:
+                        continue
+                    if weight > lexical.get(token_id, 0.0):
+                        lexical[token_id] = weight
+                dense = torch.as_tensor(row["sentence_embedding"]).float().numpy()
+                result.append(
+                    (
+                        dense,
+                        {"indices": list(lexical), "values": list(lexical.values())},
+                    )
+                )
+        return result
@@ -0,0 +1,79 @@
+"""
+Latency of the statistics paths of RedisChatDB as a function of limit:
+one round trip per row (previous implementation) against the top script
+followed by one pipeline of example reads.
+
+Fills synthetic statistics into a separate database, use a scratch one.
+
+Usage:
+    python -m src.scripts.bench_redis_stats --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+from src.services.db.redis_chat_db import TOP_EXAMPLES, RedisChatDB
+
+
+def per_row_top(redis_db: RedisChatDB, limit: int) -> List[dict]:
+    client = redis_db.client
+    rows = client.zrevrange(redis_db._stats_key(), 0, limit - 1, withscores=True)
+    return [
+        {
+            "normalized": norm,
+            "count": int(score),
+            "examples": client.srandmember(redis_db._examples_key(norm), TOP_EXAMPLES),
+        }
+        for norm, score in rows
+    ]
+
+
+def per_call_increment(redis_db: RedisChatDB, question: str) -> None:
+    redis_db.client.zincrby(redis_db._stats_key(), 1, question)
+    redis_db.client.sadd(redis_db._examples_key(question), question)
+
+
+def measure_ms(fn: Callable[[], object], repeats: int) -> float:
+    fn()
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--questions", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    redis_db = RedisChatDB(redis_url=args.redis_url)
+    redis_db.client.flushdb()
+    pipe = redis_db.client.pipeline(transaction=False)
+    for i in range(args.questions):
+        norm = f"вопрос {i}"
+        pipe.zadd(redis_db._stats_key(), {norm: args.questions - i})
+        pipe.sadd(redis_db._examples_key(norm), *[f"Вопрос {i} #{j}" for j in range(8)])
+    pipe.execute()
+
+    print(f"{'limit':>6} {'per-row ms':>11} {'batched ms':>10}")
+    for limit in (10, 50, 100, 200):
+        old = measure_ms(lambda: per_row_top(redis_db, limit), args.repeats)
+        new = measure_ms(lambda: redis_db.get_top_questions(limit), args.repeats)
+        print(f"{limit:>6} {old:>11.2f} {new:>10.2f}")
+
+    old = measure_ms(lambda: per_call_increment(redis_db, "вопрос 1"), args.repeats)
+    new = measure_ms(lambda: redis_db.increment_question("вопрос 1"), args.repeats)
+    print(f"increment_question: {old:.2f} ms -> {new:.2f} ms")
+
+    redis_db.client.flushdb()
+    redis_db.close()
+
+
+if __name__ == "__main__":
+    main()
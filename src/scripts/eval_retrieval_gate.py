@@ -0,0 +1,95 @@
+"""
+Offline evaluation of the retrieval gate on a held-out split of the labels.
+
+Reports precision/recall of skipping retrieval, the share of uncertain
+messages and the retrieval time saved. --measure-retrieval runs
+RetrievePipeline on sample queries to get the cost of one retrieval.
+
+Usage:
+    python -m src.scripts.eval_retrieval_gate --labels data/retrieval_gate_labels.jsonl
+"""
+
+import argparse
+import random
+import time
+from pathlib import Path
+
+from src.services.retrivers.retrieval_gate import NaiveBayesGate, load_labels
+from src.shared import config
+
+
+def measure_retrieval_ms(queries: list, runs: int) -> float:
+    from src.services.retrivers.pipeline import RetrievePipeline
+
+    pipeline = RetrievePipeline()
+    pipeline.run(queries[0])
+    started = time.perf_counter()
+    for query in queries[:runs]:
+        pipeline.run(query)
+    return (time.perf_counter() - started) * 1000 / min(runs, len(queries))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labels", type=Path, required=True)
+    parser.add_argument("--test-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--skip-below", type=float, default=config.retrieval_gate_skip_below
+    )
+    parser.add_argument(
+        "--retrieve-above", type=float, default=config.retrieval_gate_retrieve_above
+    )
+    parser.add_argument("--retrieval-ms", type=float, default=0.0)
+    parser.add_argument("--measure-retrieval", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_labels(args.labels)
+    random.Random(args.seed).shuffle(samples)
+    split = int(len(samples) * (1 - args.test_share))
+    train, test = samples[:split], samples[split:]
+    if not test:
+        raise SystemExit("Not enough labeled samples for a test split")
+    model = NaiveBayesGate().train(train)
+
+    true_skip = false_skip = missed_skip = uncertain = 0
+    started = time.perf_counter()
+    for text, retrieve in test:
+        proba = model.predict_proba(text)
+        if proba <= args.skip_below:
+            if retrieve:
+                false_skip += 1
+            else:
+                true_skip += 1
+        else:
+            if not retrieve:
+                missed_skip += 1
+            if proba < args.retrieve_above:
+                uncertain += 1
+    gate_ms = (time.perf_counter() - started) * 1000 / len(test)
+
+    skipped = true_skip + false_skip
+    precision = true_skip / skipped if skipped else 0.0
+    recall = true_skip / (true_skip + missed_skip) if true_skip + missed_skip else 0.0
+    print(f"Train {len(train)}, test {len(test)} samples")
+    print(f"Skip precision: {precision:.3f}, skip recall: {recall:.3f}")
+    print(f"Wrongly skipped (needed retrieval): {false_skip}")
+    print(f"Uncertain (LLM fallback or retrieval): {uncertain / len(test):.1%}")
+    print(f"Gate latency: {gate_ms:.3f} ms per message")
+
+    retrieval_ms = args.retrieval_ms
+    if args.measure_retrieval:
+        queries = [text for text, retrieve in test if retrieve] or [test[0][0]]
+        retrieval_ms = measure_retrieval_ms(queries, args.measure_retrieval)
+        print(f"Measured retrieval: {retrieval_ms:.1f} ms per query")
+    if retrieval_ms:
+        share = skipped / len(test)
+        saved = share * retrieval_ms - gate_ms
+        print(
+            f"Skipped {share:.1%} of messages, saves {saved:.1f} ms per message "
+            f"on average ({retrieval_ms:.1f} ms per retrieval)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Moves chat histories from the chat:history:* JSON blobs to the chat:messages:*
+lists. Remaining TTLs are kept. Chats that are not migrated here are moved
+lazily on their first read.
+
+Usage:
+    python -m src.scripts.migrate_chat_history --redis-url redis://localhost:6379/0
+"""
+
+import argparse
+
+from src.services.db.redis_chat_db import RedisChatDB
+from src.shared import config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default=config.redis_url)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    redis_db = RedisChatDB(redis_url=args.redis_url)
+    migrated = scanned = 0
+    pattern = f"{redis_db.history_prefix}*"
+    for key in redis_db.client.scan_iter(match=pattern, count=args.batch):
+        scanned += 1
+        chat_id = key[len(redis_db.history_prefix) :]
+        if redis_db.migrate_legacy_chat(chat_id):
+            migrated += 1
+    redis_db.close()
+    print(f"Migrated {migrated} of {scanned} legacy chat histories")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Recomputes the "normalized" field of every stored chat message, e.g. after a
+pymorphy3 dictionary update. Lemmatization runs in a process pool.
+
+Usage:
+    python -m src.scripts.renormalize_chats --workers 8
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from redis import Redis
+from redis.exceptions import WatchError
+
+from src.services.db.redis_chat_db import RedisChatDB
+from src.shared import config
+from src.shared.normalization import normalize_texts
+
+
+def rewrite_chat(client: Redis, key: str, raw: List[str], chat: List[dict]) -> bool:
+    """
+    Writes the renormalized chat back only if the list is still the one that
+    was read. Returns False if the chat expired or changed in the meantime.
+    """
+    with client.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.lrange(key, 0, -1) != raw:
+                pipe.unwatch()
+                return False
+            # LSET по индексам не меняет длину списка и TTL ключа
+            pipe.multi()
+            for idx, msg in enumerate(chat):
+                pipe.lset(key, idx, json.dumps(msg, ensure_ascii=False))
+            pipe.execute()
+            return True
+        except WatchError:
+            return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default=config.redis_url)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-chats", type=int, default=200)
+    args = parser.parse_args()
+
+    redis_db = RedisChatDB(redis_url=args.redis_url)
+    keys = list(redis_db.client.scan_iter(match=f"{redis_db.messages_prefix}*"))
+    started = time.perf_counter()
+    total = 0
+    skipped = 0
+    # Один пул на весь прогон: процессы и их кэши лемм живут между батчами
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        for i in range(0, len(keys), args.batch_chats):
+            batch_keys = keys[i : i + args.batch_chats]
+            pipe = redis_db.client.pipeline(transaction=False)
+            for key in batch_keys:
+                pipe.lrange(key, 0, -1)
+            raws = pipe.execute()
+            chats = [[json.loads(m) for m in raw] for raw in raws]
+
+            messages = [m for chat in chats for m in chat if m.get("content")]
+            normalized = normalize_texts(
+                [m["content"] for m in messages],
+                pool=pool if args.workers > 1 else None,
+            )
+            for msg, norm in zip(messages, normalized):
+                msg["normalized"] = norm
+
+            for key, raw, chat in zip(batch_keys, raws, chats):
+                # Истёкший или изменённый за это время чат пропускаем
+                if not raw or not rewrite_chat(redis_db.client, key, raw, chat):
+                    skipped += 1
+                    continue
+                total += sum(1 for m in chat if m.get("content"))
+            print(f"{min(i + args.batch_chats, len(keys))}/{len(keys)} chats")
+
+    redis_db.close()
+    print(
+        f"Renormalized {total} messages in {len(keys) - skipped} chats "
+        f"({skipped} skipped as expired or changed) "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Trains the retrieval gate classifier on labeled queries.
+
+Labels are JSONL lines {"text": ..., "retrieve": true|false}. With
+--label-from-redis logged questions from the FAQ stats are labeled by the LLM
+with RAG_NEED_TO_RETRIEVE and appended to the labels file first.
+
+Usage:
+    python -m src.scripts.train_retrieval_gate --labels data/retrieval_gate_labels.jsonl
+    python -m src.scripts.train_retrieval_gate --labels ... --label-from-redis 500
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import List
+
+from src.services.db.redis_chat_db import RedisChatDB
+from src.services.llm.llm import VllmClient
+from src.services.retrivers.retrieval_gate import (
+    NaiveBayesGate,
+    llm_needs_retrieval,
+    load_labels,
+)
+from src.shared import config
+
+
+def label_logged_questions(labels: Path, limit: int) -> int:
+    known = {text for text, _ in load_labels(labels)} if labels.exists() else set()
+    redis_db = RedisChatDB(redis_url=config.redis_url)
+    texts: List[str] = []
+    for item in redis_db.get_top_questions(limit):
+        texts += [t for t in item["examples"] if t not in known]
+    redis_db.close()
+
+    client = VllmClient()
+    labels.parent.mkdir(parents=True, exist_ok=True)
+    with open(labels, "a", encoding="utf-8") as file:
+        for text in dict.fromkeys(texts):
+            retrieve = llm_needs_retrieval(client, text)
+            # Ответ без ДА/НЕТ не годится в разметку
+            if retrieve is None:
+                continue
+            file.write(
+                json.dumps({"text": text, "retrieve": retrieve}, ensure_ascii=False)
+                + "\n"
+            )
+    return len(texts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labels", type=Path, required=True)
+    parser.add_argument(
+        "--output", type=Path, default=Path(config.retrieval_gate_model_path)
+    )
+    parser.add_argument("--label-from-redis", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.label_from_redis:
+        added = label_logged_questions(args.labels, args.label_from_redis)
+        print(f"Labeled {added} logged questions")
+
+    samples = load_labels(args.labels)
+    model = NaiveBayesGate().train(samples)
+    model.save(args.output)
+    retrieve = sum(1 for _, label in samples if label)
+    print(
+        f"Trained on {len(samples)} samples ({retrieve} retrieve, "
+        f"{len(samples) - retrieve} skip), saved to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from src.services.db.redis_chat_db import RedisChatDB
+from src.services.chat.feedback_worker import FeedbackWorker
+from src.services.chat.theme_worker import ThemeWorker
+from src.services.db.async_redis_chat_db import AsyncRedisChatDB
 
 from .container import chat_engine, logger, settings
 from .routers import (
+    admin_router,
     common_questions_router,
     common_theme_router,
     feedback_router,
@@ -27,15 +30,17 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     logger.info("lifespan start")
 
     try:
-        redis_chat_db = RedisChatDB(
+        # Роутеры работают с Redis асинхронно; ChatEngine выполняется в пуле
+        # потоков и использует собственный синхронный RedisChatDB
+        redis_chat_db = AsyncRedisChatDB(
             redis_url=settings.REDIS_URL,
             ttl=getattr(settings, "CHAT_TTL_SECONDS", 60 * 60 * 24),
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
         )
-        setattr(chat_engine, "redis_chat_db", redis_chat_db)
         app.state.redis_chat_db = redis_chat_db
-        logger.info("RedisChatDB initialized and attached to chat_engine")
+        logger.info("AsyncRedisChatDB initialized")
     except Exception as e:
-        logger.exception("Failed to create RedisChatDB: %s", e)
+        logger.exception("Failed to create AsyncRedisChatDB: %s", e)
 
     try:
         from src.services.db.qdrant_chat_db import QdrantChatDB
@@ -53,13 +58,39 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         logger.exception("Failed to create QdrantChatDB: %s", e)
 
     if inspect.iscoroutinefunction(chat_engine.start):
-        await chat_engine.start()
+        await chat_engine.start(settings.REDIS_URL)
     else:
-        await asyncio.to_thread(chat_engine.start)
+        await asyncio.to_thread(chat_engine.start, settings.REDIS_URL)
     app.state.chat_engine = chat_engine
 
+    theme_worker = None
+    if settings.THEME_WORKER_ENABLED:
+        theme_worker = ThemeWorker(
+            chat_engine,
+            batch_size=settings.THEME_WORKER_BATCH,
+            concurrency=settings.THEME_WORKER_CONCURRENCY,
+            interval=settings.THEME_WORKER_INTERVAL,
+        )
+        theme_worker.start()
+        logger.info("ThemeWorker started")
+
+    feedback_worker = None
+    if settings.FEEDBACK_WORKER_ENABLED:
+        feedback_worker = FeedbackWorker(
+            chat_engine,
+            batch_size=settings.FEEDBACK_WORKER_BATCH,
+            interval=settings.FEEDBACK_WORKER_INTERVAL,
+        )
+        feedback_worker.start()
+        logger.info("FeedbackWorker started")
+
     yield
 
+    if theme_worker is not None:
+        await theme_worker.stop()
+    if feedback_worker is not None:
+        await feedback_worker.stop()
+
     if inspect.iscoroutinefunction(chat_engine.close):
         await chat_engine.close()
     else:
@@ -67,10 +98,10 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
 
     try:
         if hasattr(app.state, "redis_chat_db") and app.state.redis_chat_db is not None:
-            app.state.redis_chat_db.close()
-            logger.info("RedisChatDB closed")
+            await app.state.redis_chat_db.close()
+            logger.info("AsyncRedisChatDB closed")
     except Exception as e:
-        logger.exception("Error while closing RedisChatDB: %s", e)
+        logger.exception("Error while closing AsyncRedisChatDB: %s", e)
 
     try:
         if (
@@ -113,6 +144,7 @@ router.include_router(common_theme_router, prefix=settings.API_V1_STR)
 router.include_router(common_questions_router, prefix=settings.API_V1_STR)
 router.include_router(query_router, prefix=settings.API_V1_STR)
 router.include_router(feedback_router, prefix=settings.API_V1_STR)
+router.include_router(admin_router, prefix=settings.API_V1_STR)
 
 
 @app.middleware("http")
@@ -148,7 +180,7 @@ faq_router = APIRouter(prefix=settings.API_V1_STR)
 @faq_router.get("/faq")
 async def get_faq(request: Request, limit: int = 10) -> dict:
     redis_db = request.app.state.redis_chat_db
-    return {"questions": redis_db.get_top_questions(limit)}
+    return {"questions": await redis_db.get_top_questions(limit)}
 
 
 app.include_router(faq_router)
@@ -1,9 +1,11 @@
+from .admin import router as admin_router
 from .feedback import router as feedback_router
 from .get_common_questions import router as common_questions_router
 from .get_common_theme import router as common_theme_router
 from .process_query import router as query_router
 
 __all__ = [
+    "admin_router",
     "feedback_router",
     "query_router",
     "common_questions_router",
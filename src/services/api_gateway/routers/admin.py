@@ -0,0 +1,57 @@
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
+
+from src.services.db.qdrant_answer_cache import QdrantAnswerCache
+from src.shared import normalization
+
+from ..container import logger
+from ..settings import settings
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token, settings.ADMIN_TOKEN
+    ):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    include_in_schema=False,
+    dependencies=[Depends(require_admin)],
+)
+
+
+def _answer_cache(request: Request) -> QdrantAnswerCache:
+    answer_cache = request.app.state.chat_engine.answer_cache
+    if answer_cache is None:
+        raise HTTPException(status_code=404, detail="Answer cache is disabled")
+    return answer_cache
+
+
+@router.get("/answer_cache/stats")
+async def answer_cache_stats(request: Request) -> dict:
+    answer_cache = _answer_cache(request)
+    return await run_in_threadpool(answer_cache.stats)
+
+
+@router.post("/answer_cache/purge")
+async def purge_answer_cache(
+    request: Request,
+    expired_only: bool = Query(True),
+) -> dict:
+    answer_cache = _answer_cache(request)
+    removed = await run_in_threadpool(answer_cache.purge, expired_only)
+    logger.info(f"Answer cache purge requested, removed {removed} entries")
+    return {"removed": removed}
+
+
+@router.get("/normalization/stats")
+async def normalization_stats() -> dict:
+    return normalization.cache_info()
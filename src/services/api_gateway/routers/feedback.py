@@ -2,7 +2,6 @@ from datetime import datetime
 
 from fastapi import APIRouter, Request, status
 from fastapi.responses import JSONResponse
-from starlette.concurrency import run_in_threadpool
 
 from ..container import logger
 from ..schemes import FeedbackIn
@@ -26,7 +25,7 @@ async def __submit_feedback(request: Request, payload: FeedbackIn) -> None:
         logger.info(
             f"Get feedback rating: {payload.rating}, message: {payload.feedback}"
         )
-        await run_in_threadpool(redis_db.client.rpush, "feedbacks", str(feedback_entry))
+        await redis_db.add_feedback(feedback_entry)
 
         return JSONResponse(
             status_code=status.HTTP_201_CREATED,
@@ -1,9 +1,12 @@
+import time
 from datetime import datetime
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from fastapi import APIRouter, Query, Request
 from starlette.concurrency import run_in_threadpool
 
+from src.services.db.redis_chat_db import STATS_WINDOWS
+
 from ..container import logger
 from ..schemes import StatItem, StatOut
 
@@ -14,13 +17,14 @@ async def __common_questions(
     request: Request,
     limit: int,
     source: Literal["redis", "qdrant"] = "redis",
+    window: Optional[str] = None,
 ) -> StatOut:
     try:
         items: List[StatItem] = []
 
         if source == "redis":
             redis_db = request.app.state.redis_chat_db
-            raw = await run_in_threadpool(redis_db.get_top_questions, limit)
+            raw = await redis_db.get_top_questions(limit, window)
             for r in raw:
                 norm = r.get("normalized") if isinstance(r, dict) else None
                 cnt = int(r.get("count", 0)) if isinstance(r, dict) else 0
@@ -31,7 +35,12 @@ async def __common_questions(
 
         elif source == "qdrant":
             qdrant_db = request.app.state.chat_engine.qdrant_chat_db
-            raw = await run_in_threadpool(qdrant_db.top_normalized_phrases, limit)
+            since_ts = None
+            if window is not None:
+                since_ts = time.time() - STATS_WINDOWS[window] * 3600
+            raw = await run_in_threadpool(
+                qdrant_db.top_normalized_phrases, limit, since_ts
+            )
             for norm, cnt in raw:
                 examples = await run_in_threadpool(
                     qdrant_db.search_similar,
@@ -68,5 +77,6 @@ async def common_themes(
     request: Request,
     limit: int = Query(10, ge=1, le=200),
     source: Literal["redis", "qdrant"] = Query("redis"),
+    window: Optional[Literal["1h", "24h", "7d"]] = Query(None),
 ):
-    return await __common_questions(request, limit, source)
+    return await __common_questions(request, limit, source, window)
@@ -1,8 +1,7 @@
 from datetime import datetime
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from fastapi import APIRouter, Query, Request
-from starlette.concurrency import run_in_threadpool
 
 from ..container import logger
 from ..schemes import StatItem, StatOut
@@ -14,19 +13,18 @@ async def __common_themes(
     request: Request,
     limit: int,
     source: Literal["redis", "qdrant"] = "redis",
+    window: Optional[str] = None,
 ) -> StatOut:
     try:
         items: List[StatItem] = []
 
         redis_db = request.app.state.redis_chat_db
-        raw = await run_in_threadpool(redis_db.get_top_themes, limit)
+        raw = await redis_db.get_top_themes(limit, window)
         for r in raw:
             norm = r.get("normalized") if isinstance(r, dict) else None
             cnt = int(r.get("count", 0)) if isinstance(r, dict) else 0
             examples = r.get("examples") if isinstance(r, dict) else []
-            items.append(
-                StatItem(normalized=norm or "", count=cnt, examples=examples)
-            )
+            items.append(StatItem(normalized=norm or "", count=cnt, examples=examples))
 
         return StatOut(
             generated_at=datetime.utcnow().isoformat() + "Z",
@@ -44,5 +42,6 @@ async def common_themes(
     request: Request,
     limit: int = Query(10, ge=1, le=200),
     source: Literal["redis"] = Query("redis"),
+    window: Optional[Literal["1h", "24h", "7d"]] = Query(None),
 ):
-    return await __common_themes(request, limit, source)
\ No newline at end of file
+    return await __common_themes(request, limit, source, window)
@@ -1,10 +1,12 @@
-import re
-import time
 import asyncio
+import json
+import threading
+import time
 import traceback
+from typing import AsyncIterator, Iterator, Set
 
-import pymorphy3
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from starlette.concurrency import run_in_threadpool
 
 from ..container import chat_engine, logger
@@ -16,21 +18,8 @@ OPERATOR_TEMPLATE = (
     "Спасибо!"
 )
 
-_morph = pymorphy3.MorphAnalyzer()
-
-
-def normalize_text(text: str) -> str:
-    if not text:
-        return ""
-    tokens = re.findall(r"\w+", text.lower())
-    lemmas = []
-    for t in tokens:
-        try:
-            lemmas.append(_morph.parse(t)[0].normal_form)
-        except Exception:
-            lemmas.append(t)
-    return " ".join(lemmas)
-
+OPERATOR_TOKEN = "[ОПЕРАТОР]"
+QUERY_TIMEOUT = 300.0
 
 router = APIRouter(tags=["process_query", "query"], include_in_schema=False)
 
@@ -43,7 +32,7 @@ async def __process_query(
     try:
         text, docs = await asyncio.wait_for(
             run_in_threadpool(chat_engine.user_query, input_.user_id, input_.query),
-            timeout=300.0
+            timeout=QUERY_TIMEOUT,
         )
     except Exception as e:
         tb = traceback.format_exc()
@@ -57,7 +46,7 @@ async def __process_query(
         )
         raise HTTPException(status_code=500, detail="Query failed")
 
-    if "[ОПЕРАТОР]" in text:
+    if OPERATOR_TOKEN in text:
         logger.info(
             {
                 "ts": time.time(),
@@ -69,30 +58,14 @@ async def __process_query(
     else:
         final_response = (text, docs)
 
+    # Тема генерируется фоновым ThemeWorker, запрос её не ждёт
     redis_db = request.app.state.redis_chat_db
-    history = redis_db.get_chat(q.user_id)
-    theme = redis_db.get_theme(q.user_id)
-    logger.info(f"History len: {len(history.history)}")
-
-    if len(history.history) >= 0 and not theme:
-        theme = await run_in_threadpool(chat_engine.gen_main_theme, history)
-        redis_db.save_theme(q.user_id, theme)
-        norm_theme = normalize_text(theme)
+    theme = await redis_db.get_theme(q.user_id)
+    if not theme:
         try:
-            redis_db.client.zincrby("chat:stats:themes", 1, norm_theme)
-            redis_db.client.sadd(f"chat:stats:themes:examples:{norm_theme}", theme)
+            await redis_db.enqueue_theme(q.user_id)
         except Exception as e:
-            logger.warning(f"Failed to save theme stats: {e}")
-
-        qdrant_db = request.app.state.chat_engine.qdrant_chat_db
-        try:
-            vector = await run_in_threadpool(chat_engine.embed_text, theme)
-            qdrant_db.upsert_theme(norm_theme, theme, vector)
-        except Exception as e:
-            logger.warning(f"Failed to save theme to Qdrant: {e}")
-
-    else:
-        theme = theme if theme else None
+            logger.warning(f"Failed to enqueue theme generation: {e}")
 
     logger.info(f"Theme: {theme}")
 
@@ -102,3 +75,167 @@ async def __process_query(
 @router.post("/query")
 async def process_query(request: Request, input_: QueryIn) -> QueryOut:
     return await __process_query(request, input_)
+
+
+class OperatorTokenFilter:
+    """
+    Passes streamed text through, holding back a tail that may be the start
+    of OPERATOR_TOKEN split between chunks.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.detected = False
+
+    def feed(self, text: str) -> str:
+        if self.detected:
+            return ""
+        self.buffer += text
+        if OPERATOR_TOKEN in self.buffer:
+            self.detected = True
+            self.buffer = ""
+            return ""
+        hold = 0
+        for size in range(min(len(OPERATOR_TOKEN) - 1, len(self.buffer)), 0, -1):
+            if OPERATOR_TOKEN.startswith(self.buffer[-size:]):
+                hold = size
+                break
+        out = self.buffer[: len(self.buffer) - hold]
+        self.buffer = self.buffer[len(out) :]
+        return out
+
+    def flush(self) -> str:
+        out, self.buffer = ("" if self.detected else self.buffer), ""
+        return out
+
+
+def _sse(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background: Set[asyncio.Task] = set()
+_DONE = object()
+
+
+def _produce(
+    tokens: Iterator[str],
+    queue: asyncio.Queue,
+    loop: asyncio.AbstractEventLoop,
+    stop: threading.Event,
+) -> None:
+    # Генерация идёт в отдельном потоке. Когда поток ответа перестаёт читать
+    # (разрыв соединения, таймаут, маркер оператора), stop прерывает её:
+    # итератор закрывается вместе с запросом к LLM, ChatEngine сохраняет
+    # начало ответа
+    try:
+        for token in tokens:
+            if stop.is_set():
+                break
+            loop.call_soon_threadsafe(queue.put_nowait, token)
+    except Exception as e:
+        loop.call_soon_threadsafe(queue.put_nowait, e)
+    finally:
+        close = getattr(tokens, "close", None)
+        if close is not None:
+            close()
+        loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+
+async def _enqueue_theme_after(
+    request: Request, user_id: str, producer: asyncio.Future
+) -> None:
+    # История сохранена, когда поток генерации завершился,
+    # воркер построит тему по полному диалогу
+    try:
+        await producer
+        redis_db = request.app.state.redis_chat_db
+        if not await redis_db.get_theme(user_id):
+            await redis_db.enqueue_theme(user_id)
+    except Exception as e:
+        logger.warning(f"Failed to enqueue theme generation: {e}")
+
+
+async def __stream_query(request: Request, input_: QueryIn) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + QUERY_TIMEOUT
+    stop = threading.Event()
+    try:
+        links, tokens = await asyncio.wait_for(
+            run_in_threadpool(
+                chat_engine.user_query_stream, input_.user_id, input_.query
+            ),
+            timeout=QUERY_TIMEOUT,
+        )
+        yield _sse("links", links)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = loop.run_in_executor(None, _produce, tokens, queue, loop, stop)
+        task = asyncio.create_task(
+            _enqueue_theme_after(request, input_.user_id, producer)
+        )
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+        marker = OperatorTokenFilter()
+        while True:
+            item = await asyncio.wait_for(
+                queue.get(), timeout=max(deadline - loop.time(), 0)
+            )
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            text = marker.feed(item)
+            if text:
+                yield _sse("token", {"text": text})
+            # Ответ всё равно заменяется шаблоном, дальше генерировать незачем
+            if marker.detected:
+                stop.set()
+                break
+        tail = marker.flush()
+        if tail:
+            yield _sse("token", {"text": tail})
+
+        if marker.detected:
+            logger.info(
+                {
+                    "ts": time.time(),
+                    "request_id": input_.user_id,
+                    "event": "operator_token_detected",
+                }
+            )
+            # Клиент заменяет уже показанный текст шаблоном
+            yield _sse("operator", {"text": OPERATOR_TEMPLATE})
+        yield _sse("done", {"operator": marker.detected})
+    except asyncio.TimeoutError:
+        logger.error(
+            {
+                "ts": time.time(),
+                "request_id": input_.user_id,
+                "error": f"Stream timed out after {QUERY_TIMEOUT}s",
+            }
+        )
+        yield _sse("error", {"detail": "Query timed out"})
+    except Exception as e:
+        logger.error(
+            {
+                "ts": time.time(),
+                "request_id": input_.user_id,
+                "error": str(e),
+                "traceback": traceback.format_exc(),
+            }
+        )
+        yield _sse("error", {"detail": "Query failed"})
+    finally:
+        # Срабатывает и при отмене ответа Starlette после разрыва соединения
+        stop.set()
+
+
+@router.post("/query/stream")
+async def process_query_stream(request: Request, input_: QueryIn) -> StreamingResponse:
+    return StreamingResponse(
+        __stream_query(request, input_),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,3 +1,6 @@
+from typing import Optional
+
+from src.shared import config
 from src.shared.settings import SharedSettings
 
 
@@ -7,9 +10,19 @@ class Settings(SharedSettings):
     API_PORT: int = 8080
     RELOAD: bool = True
     API_V1_STR: str = "/api/v1"
-    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_URL: str = config.redis_url
+    REDIS_MAX_CONNECTIONS: int = 64
     EMBEDING_MODEL_DIM: int = 384
     QDRANT_URL: str = "http://localhost:6333"
+    THEME_WORKER_ENABLED: bool = True
+    THEME_WORKER_BATCH: int = 16
+    THEME_WORKER_CONCURRENCY: int = 8
+    THEME_WORKER_INTERVAL: float = 2.0
+    FEEDBACK_WORKER_ENABLED: bool = True
+    FEEDBACK_WORKER_BATCH: int = 100
+    FEEDBACK_WORKER_INTERVAL: float = 2.0
+    # Без токена /admin закрыт целиком
+    ADMIN_TOKEN: Optional[str] = None
 
 
 settings = Settings()
@@ -1,15 +1,19 @@
 import time
 import uuid
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from haystack import Document
 
 from src.services.chat.chat_history import ChatHistory
+from src.services.db.qdrant_answer_cache import QdrantAnswerCache
 from src.services.db.qdrant_chat_db import QdrantChatDB
 from src.services.db.redis_chat_db import RedisChatDB
 from src.services.llm.llm import VllmClient
 from src.services.llm.prompts import GET_MAIN_THEME, RAG_SYSTEM_PROMPT
 from src.services.retrivers.pipeline import RetrievePipeline
+from src.services.retrivers.retrieval_cache import RetrievalCache
+from src.services.retrivers.retrieval_gate import RetrievalGate
+from src.shared import config
 from src.shared.logger import CustomLogger
 
 
@@ -19,21 +23,39 @@ class ChatEngine:
         self.redis_chat_db = None
         self.qdrant_chat_db = None
         self.retriever = None
+        self.answer_cache = None
+        self.retrieval_gate = None
         self.logger = CustomLogger("ChatEngine")
 
-    def start(self) -> None:
+    def start(self, redis_url: Optional[str] = None) -> None:
         self.client = VllmClient()
+        redis_url = redis_url or config.redis_url
 
-        self.redis_chat_db = RedisChatDB(
-            redis_url="redis://localhost:6379/0", ttl=60 * 60 * 24
-        )
+        self.redis_chat_db = RedisChatDB(redis_url=redis_url, ttl=60 * 60 * 24)
         self.qdrant_chat_db = QdrantChatDB(
             url="http://localhost:6333",
             collection="chat_messages",
             vector_size=1536,
             recreate=False,
         )
-        self.retriever = RetrievePipeline()
+        retrieval_cache = None
+        if config.retrieval_cache_enabled:
+            retrieval_cache = RetrievalCache(
+                redis_url=redis_url, ttl=config.retrieval_cache_ttl
+            )
+        self.retriever = RetrievePipeline(cache=retrieval_cache)
+        if config.retrieval_gate_enabled:
+            self.retrieval_gate = RetrievalGate(
+                llm_client=self.client if config.retrieval_gate_llm_fallback else None
+            )
+        if config.answer_cache_enabled:
+            self.answer_cache = QdrantAnswerCache(
+                url=config.db_server_url,
+                collection=config.answer_cache_collection,
+                vector_size=config.embedding_model_dim,
+                threshold=config.answer_cache_threshold,
+                ttl=config.answer_cache_ttl,
+            )
 
     def close(self) -> None:
         self.client = None
@@ -47,9 +69,18 @@ class ChatEngine:
                 self.qdrant_chat_db.close()
         except Exception:
             pass
+        try:
+            if self.retriever and self.retriever.cache:
+                self.retriever.cache.close()
+        except Exception:
+            pass
+        if self.answer_cache:
+            self.answer_cache.close()
         self.redis_chat_db = None
         self.qdrant_chat_db = None
         self.retriever = None
+        self.answer_cache = None
+        self.retrieval_gate = None
 
     def _stable_point_id(self, chat_id: str, ts: float, text: str, idx: int) -> str:
         base = f"{chat_id}:{int(ts * 1000)}:{idx}:{text}"
@@ -95,6 +126,7 @@ class ChatEngine:
                         "timestamp",
                         "created_at",
                         "time",
+                        "tokens",
                     )
                 }
 
@@ -113,31 +145,72 @@ class ChatEngine:
                 )
 
             if q_items:
-                self.qdrant_chat_db.upsert_messages(q_items)
+                written = self.qdrant_chat_db.upsert_messages(q_items)
                 self.logger.info(
-                    f"Synced {len(q_items)} messages from chat {chat_id} to Qdrant"
+                    f"Synced {written} new of {len(q_items)} messages "
+                    f"from chat {chat_id} to Qdrant"
                 )
 
         except Exception as e:
             self.logger.exception(f"Failed to sync chat {chat_id} to Qdrant: {e}")
 
-    def user_query(self, user_id: str, message: str) -> Tuple[str, List[str]]:
+    def _start_turn(
+        self, user_id: str, message: str
+    ) -> Tuple[ChatHistory, Optional[List[float]], Optional[Tuple[str, List[str]]]]:
         if self.redis_chat_db is None or self.client is None or self.retriever is None:
             raise RuntimeError("ChatEngine not started. Call start() first.")
 
         history = self.redis_chat_db.get_chat(user_id)
+        first_turn = history.history == []
 
-        if history.history == []:
+        if first_turn:
             history.add_system_message(RAG_SYSTEM_PROMPT)
 
         history.add_user_message(message)
 
         self.redis_chat_db.increment_question(message)
 
-        retrieved_text: Optional[str] = None
-        links: List[str] = []
+        # Ответ на первый вопрос не зависит от истории и может быть переиспользован
+        query_vector = None
+        cached = None
+        if first_turn and self.answer_cache is not None:
+            try:
+                query_vector = self.answer_cache.embed_client.embed_one(
+                    message
+                ).tolist()
+                cached = self.answer_cache.lookup(query_vector)
+            except Exception as e:
+                self.logger.exception(f"Answer cache lookup failed: {e}")
+                query_vector, cached = None, None
+        return history, query_vector, cached
 
-        retrieved_text, documents = self.retriever.run(message)
+    @staticmethod
+    def _previous_exchange(history: ChatHistory) -> List[Dict[str, str]]:
+        # Последняя пара вопрос-ответ перед текущим сообщением
+        dialog = [
+            {"role": m["role"], "content": m["content"]}
+            for m in history.history[:-1]
+            if isinstance(m, dict) and m.get("role") in ("user", "assistant")
+        ]
+        return dialog[-2:]
+
+    def _build_prompt(
+        self, history: ChatHistory, message: str
+    ) -> Tuple[List[Dict[str, str]], List[str]]:
+        previous = self._previous_exchange(history)
+        if self.retrieval_gate is not None and not self.retrieval_gate.decide(
+            message, "\n".join(m["content"] for m in previous)
+        ):
+            # Приветствие, благодарность или уточнение: документы не ищутся,
+            # уточнению хватает предыдущего ответа
+            prompt_messages = [{"role": "system", "content": RAG_SYSTEM_PROMPT}]
+            prompt_messages += previous
+            prompt_messages.append({"role": "user", "content": message})
+            self.logger.info(f"Prompt messages: {prompt_messages}")
+            return prompt_messages, []
+
+        retrieved_text, documents, stats = self.retriever.run(message)
+        self.logger.info(f"Retrieval stats: {stats}")
         if retrieved_text:
             history.add_system_message(retrieved_text)
 
@@ -149,10 +222,79 @@ class ChatEngine:
         prompt_messages.append({"role": "user", "content": message})
 
         self.logger.info(f"Prompt messages: {prompt_messages}")
+        return prompt_messages, links
+
+    def _finish_turn(
+        self,
+        user_id: str,
+        message: str,
+        history: ChatHistory,
+        answer: str,
+        links: List[str],
+        query_vector: Optional[List[float]],
+    ) -> None:
+        history.add_assistant_message(answer)
+        self._save_history(user_id, history)
+
+        # Ответы с передачей оператору не кэшируются
+        if query_vector is not None and "[ОПЕРАТОР]" not in answer:
+            try:
+                self.answer_cache.store(query_vector, message, answer, links)
+            except Exception as e:
+                self.logger.exception(f"Failed to store answer in cache: {e}")
+
+    def user_query(self, user_id: str, message: str) -> Tuple[str, List[str]]:
+        history, query_vector, cached = self._start_turn(user_id, message)
+        if cached is not None:
+            answer, links = cached
+            self._finish_turn(user_id, message, history, answer, links, None)
+            return answer, links
+
+        prompt_messages, links = self._build_prompt(history, message)
         answer = self.client.generate(prompt_messages)
+        self._finish_turn(user_id, message, history, answer, links, query_vector)
+        return answer, links
 
-        history.add_assistant_message(answer)
+    def user_query_stream(
+        self, user_id: str, message: str
+    ) -> Tuple[List[str], Iterator[str]]:
+        """
+        Runs retrieval and returns the links together with an iterator over
+        the answer tokens. The turn is saved when the iterator is exhausted or
+        closed; an interrupted answer is saved as is but not cached.
+        """
+        history, query_vector, cached = self._start_turn(user_id, message)
+        if cached is not None:
+            answer, links = cached
+            self._finish_turn(user_id, message, history, answer, links, None)
+            return links, iter([answer])
+
+        prompt_messages, links = self._build_prompt(history, message)
+
+        def tokens() -> Iterator[str]:
+            parts: List[str] = []
+            complete = False
+            stream = self.client.generate_stream(prompt_messages)
+            try:
+                for token in stream:
+                    parts.append(token)
+                    yield token
+                complete = True
+            finally:
+                # Прерванный ответ не должен держать запрос к LLM открытым
+                stream.close()
+                self._finish_turn(
+                    user_id,
+                    message,
+                    history,
+                    "".join(parts),
+                    links,
+                    query_vector if complete else None,
+                )
+
+        return links, tokens()
 
+    def _save_history(self, user_id: str, history: ChatHistory) -> None:
         try:
             self.redis_chat_db.save_chat(user_id, history)
         except Exception as e:
@@ -162,13 +304,11 @@ class ChatEngine:
 
         try:
             self._sync_chat_to_qdrant(user_id)
-        except Exception:
+        except Exception as e:
             self.logger.exception(
                 f"Failed to save chat to Qdrant for user {user_id}: {e}"
             )
 
-        return answer, links
-
     def parse_links(self, docs: List[Document]) -> List[str]:
         links: List[str] = []
         for doc in docs:
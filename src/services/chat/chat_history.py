@@ -1,39 +1,54 @@
-from typing import Dict, List, Optional
-
-from transformers import AutoTokenizer
+from typing import Any, Dict, List, Optional
 
 from src.services.llm.prompts import RAG_SYSTEM_PROMPT
+from src.shared.tokenizer import count_tokens
 
 
 class ChatHistory:
     def __init__(
-        self, history: Optional[List[Dict[str, str]]] = None, max_tokens: int = 5000
+        self, history: Optional[List[Dict[str, Any]]] = None, max_tokens: int = 5000
     ) -> None:
         self.history = history or []
         self.max_tokens = max_tokens
-        self.tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen3-8B")
+        # Сколько первых сообщений уже лежит в хранилище и был ли список
+        # переписан целиком (тогда хранилище перезаписывается)
+        self.persisted = 0
+        self.rewritten = False
+
+    @staticmethod
+    def _message(role: str, content: str) -> Dict[str, Any]:
+        # Число токенов считается один раз и сохраняется вместе с сообщением
+        return {"role": role, "content": content, "tokens": count_tokens(content)}
+
+    @staticmethod
+    def message_tokens(message: Dict[str, Any]) -> int:
+        if "tokens" not in message:
+            # Сообщения, сохранённые до появления поля tokens
+            message["tokens"] = count_tokens(message.get("content") or "")
+        return message["tokens"]
 
     def add_system_message(self, message: str) -> None:
-        self.history.append({"role": "system", "content": message})
+        self.history.append(self._message("system", message))
 
     def add_user_message(self, message: str) -> None:
-        self.history.append({"role": "user", "content": message})
+        self.history.append(self._message("user", message))
 
     def add_assistant_message(self, message: str) -> None:
-        self.history.append({"role": "assistant", "content": message})
+        self.history.append(self._message("assistant", message))
 
     def num_tokens(self) -> int:
-        return sum(len(self.tokenizer.encode(msg["content"])) for msg in self.history)
+        return sum(self.message_tokens(msg) for msg in self.history)
 
     def truncate_by_tokens(self) -> None:
-        truncated: List[Dict[str, str]] = []
-
         total_tokens = 0
-        for msg in reversed(self.history):
-            msg_tokens = len(self.tokenizer.encode(msg["content"]))
+        start = len(self.history)
+        for i in range(len(self.history) - 1, -1, -1):
+            msg_tokens = self.message_tokens(self.history[i])
             if total_tokens + msg_tokens > self.max_tokens:
                 break
-            truncated.insert(0, msg)
             total_tokens += msg_tokens
+            start = i
 
-        self.history = [{"role": "system", "content": RAG_SYSTEM_PROMPT}] + truncated
+        system = self._message("system", RAG_SYSTEM_PROMPT)
+        self.history = [system] + self.history[start:]
+        self.rewritten = True
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.services.chat.chat_engine import ChatEngine
+from src.shared.logger import CustomLogger
+
+
+class FeedbackWorker:
+    """
+    Moves ratings from the chat:feedback stream into Qdrant. Entries are read
+    through a consumer group in batches, applied as one bulk payload update
+    on the rated assistant messages and acknowledged only after it succeeds.
+    """
+
+    def __init__(
+        self,
+        chat_engine: ChatEngine,
+        batch_size: int = 100,
+        interval: float = 2.0,
+        consumer: Optional[str] = None,
+    ) -> None:
+        self.chat_engine = chat_engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.consumer = consumer or f"{socket.gethostname()}:{os.getpid()}"
+        self.logger = CustomLogger("feedback_worker")
+        self._task: Optional[asyncio.Task] = None
+        self._group_ready = False
+
+    def _parse(self, fields: Dict[str, str]) -> Optional[Tuple[str, str, float]]:
+        try:
+            return fields["user_id"], fields["model_response"], float(fields["rating"])
+        except (KeyError, ValueError):
+            return None
+
+    def process_batch(self) -> int:
+        redis_db = self.chat_engine.redis_chat_db
+        if not self._group_ready:
+            redis_db.ensure_feedback_group()
+            self._group_ready = True
+
+        entries = redis_db.read_feedback(self.consumer, self.batch_size)
+        if not entries:
+            return 0
+
+        started = time.perf_counter()
+        # Повторная оценка того же ответа в батче перекрывает предыдущую
+        ratings: Dict[Tuple[str, str], float] = {}
+        for entry_id, fields in entries:
+            parsed = self._parse(fields)
+            if parsed is None:
+                self.logger.warn(f"Skipping malformed feedback {entry_id}: {fields}")
+                continue
+            chat_id, response, rating = parsed
+            ratings[(chat_id, response)] = rating
+
+        items: List[Tuple[str, str, float]] = [
+            (chat_id, response, rating)
+            for (chat_id, response), rating in ratings.items()
+        ]
+        # Без подтверждения записи останутся в PEL и будут забраны повторно
+        unmatched = self.chat_engine.qdrant_chat_db.update_response_quality_batch(items)
+        redis_db.ack_feedback([entry_id for entry_id, _ in entries])
+
+        # Например, ответ оператора или чат, ещё не выгруженный в Qdrant
+        for chat_id, response, rating in unmatched:
+            self.logger.warn(
+                f"Rating {rating} for chat {chat_id} matched no stored response: "
+                f"{response[:80]!r}"
+            )
+        self.logger.info(
+            f"Applied {len(items) - len(unmatched)} of {len(items)} ratings "
+            f"from {len(entries)} feedback entries "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return len(entries)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                processed = await asyncio.to_thread(self.process_batch)
+            except Exception as e:
+                self.logger.exception(f"Feedback batch failed: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+if __name__ == "__main__":
+    engine = ChatEngine()
+    engine.start()
+    worker = FeedbackWorker(engine)
+    try:
+        asyncio.run(worker.run())
+    finally:
+        engine.close()
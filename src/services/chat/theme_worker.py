@@ -0,0 +1,122 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from src.services.chat.chat_engine import ChatEngine
+from src.shared.logger import CustomLogger
+from src.shared.normalization import normalize_text
+
+
+class ThemeWorker:
+    """
+    Generates chat themes in the background. The gateway only enqueues chat ids
+    into chat:theme:pending; the worker pops them in batches, sends the theme
+    prompts to vLLM concurrently, embeds all themes with one call and writes
+    Redis stats and Qdrant points.
+    """
+
+    def __init__(
+        self,
+        chat_engine: ChatEngine,
+        batch_size: int = 16,
+        concurrency: int = 8,
+        interval: float = 2.0,
+    ) -> None:
+        self.chat_engine = chat_engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.logger = CustomLogger("theme_worker")
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="theme"
+        )
+        self._task: Optional[asyncio.Task] = None
+
+    def _gen_theme(self, chat_id: str) -> Optional[str]:
+        redis_db = self.chat_engine.redis_chat_db
+        if redis_db.get_theme(chat_id):
+            return None
+        history = redis_db.get_chat(chat_id)
+        if not history.history:
+            return None
+        try:
+            return self.chat_engine.gen_main_theme(history) or None
+        except Exception as e:
+            self.logger.exception(f"Failed to generate theme for chat {chat_id}: {e}")
+            return None
+
+    def process_batch(self) -> int:
+        redis_db = self.chat_engine.redis_chat_db
+        chat_ids = redis_db.pop_pending_themes(self.batch_size)
+        if not chat_ids:
+            return 0
+
+        started = time.perf_counter()
+        themes: Dict[str, str] = {
+            chat_id: theme
+            for chat_id, theme in zip(
+                chat_ids, self._executor.map(self._gen_theme, chat_ids)
+            )
+            if theme
+        }
+
+        items: List[Dict[str, object]] = []
+        for chat_id, theme in themes.items():
+            try:
+                redis_db.save_theme(chat_id, theme)
+                redis_db.increment_theme(theme)
+            except Exception as e:
+                self.logger.warn(f"Failed to save theme stats for chat {chat_id}: {e}")
+            items.append(
+                {
+                    "chat_id": chat_id,
+                    "theme": theme,
+                    "normalized_theme": normalize_text(theme),
+                    "timestamp": time.time(),
+                }
+            )
+
+        try:
+            self.chat_engine.qdrant_chat_db.upsert_themes(items)
+        except Exception as e:
+            self.logger.warn(f"Failed to save themes to Qdrant: {e}")
+
+        self.logger.info(
+            f"Generated {len(items)} themes for {len(chat_ids)} chats "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return len(chat_ids)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                processed = await asyncio.to_thread(self.process_batch)
+            except Exception as e:
+                self.logger.exception(f"Theme batch failed: {e}")
+                processed = 0
+            # Полный батч означает, что очередь ещё не разобрана
+            if processed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # Отдельный процесс воркера, если тема не должна делить ресурсы с gateway
+    engine = ChatEngine()
+    engine.start()
+    worker = ThemeWorker(engine)
+    try:
+        asyncio.run(worker.run())
+    finally:
+        engine.close()
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as aioredis
+from redis.exceptions import WatchError
+
+from src.services.chat.chat_history import ChatHistory
+from src.services.db.redis_chat_db import (
+    DEFAULT_HISTORY_PREFIX,
+    DEFAULT_MESSAGES_PREFIX,
+    DEFAULT_STATS_EXAMPLES_PREFIX,
+    DEFAULT_STATS_PREFIX,
+    DEFAULT_THEME_PREFIX,
+    DEFAULT_TTL,
+    FEEDBACK_MAXLEN,
+    FEEDBACK_STREAM,
+    THEME_EXAMPLES_KEY,
+    THEME_PENDING_KEY,
+    THEME_STATS_KEY,
+    TOP_EXAMPLES,
+    WINDOW_CACHE_TTL,
+    _enrich_message,
+    increment_args,
+    queue_prune,
+    top_pairs,
+    top_rows,
+    window_keys,
+)
+from src.services.db.redis_scripts import (
+    INCREMENT_WITH_SAMPLE,
+    READ_EXAMPLES,
+    TOP_ENTRIES,
+)
+from src.shared.logger import CustomLogger
+from src.shared.normalization import normalize_text
+
+
+class AsyncRedisChatDB:
+    """
+    RedisChatDB on redis.asyncio for the gateway event loop. Keys and formats
+    are the same as in RedisChatDB, which stays for scripts and ChatEngine.
+    """
+
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379/0",
+        history_prefix: str = DEFAULT_HISTORY_PREFIX,
+        stats_prefix: str = DEFAULT_STATS_PREFIX,
+        ttl: Optional[int] = DEFAULT_TTL,
+        messages_prefix: str = DEFAULT_MESSAGES_PREFIX,
+        max_connections: int = 64,
+    ) -> None:
+        # Один пул на процесс: все корутины gateway делят соединения
+        self.pool = aioredis.ConnectionPool.from_url(
+            redis_url, decode_responses=True, max_connections=max_connections
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        self.history_prefix = history_prefix
+        self.messages_prefix = messages_prefix
+        self.stats_prefix = stats_prefix
+        self.stats_examples_prefix = DEFAULT_STATS_EXAMPLES_PREFIX
+        self.theme_prefix = DEFAULT_THEME_PREFIX
+        self.ttl = ttl
+        self._top_entries = self.client.register_script(TOP_ENTRIES)
+        self._read_examples = self.client.register_script(READ_EXAMPLES)
+        self._increment_with_sample = self.client.register_script(INCREMENT_WITH_SAMPLE)
+        self.logger = CustomLogger("async_redis_chat_db")
+
+    def _history_key(self, chat_id: str) -> str:
+        return f"{self.history_prefix}{chat_id}"
+
+    def _messages_key(self, chat_id: str) -> str:
+        return f"{self.messages_prefix}{chat_id}"
+
+    def _stats_key(self) -> str:
+        return f"{self.stats_prefix}questions"
+
+    def _examples_key(self, normalized: str) -> str:
+        return f"{self.stats_examples_prefix}{normalized}"
+
+    def _theme_key(self, chat_id: str) -> str:
+        return f"{self.theme_prefix}{chat_id}"
+
+    async def get_chat(self, chat_id: str, last: Optional[int] = None) -> ChatHistory:
+        start = -last if last else 0
+        raw = await self.client.lrange(self._messages_key(chat_id), start, -1)
+        if not raw and await self.migrate_legacy_chat(chat_id):
+            raw = await self.client.lrange(self._messages_key(chat_id), start, -1)
+        try:
+            history = ChatHistory([json.loads(item) for item in raw])
+        except Exception:
+            return ChatHistory()
+        history.persisted = len(history.history)
+        return history
+
+    async def save_chat(self, chat_id: str, history: ChatHistory) -> None:
+        key = self._messages_key(chat_id)
+        if history.rewritten:
+            new_items = history.history
+        else:
+            new_items = history.history[history.persisted :]
+        # Лемматизация длинных сообщений не должна занимать event loop
+        enriched = await asyncio.to_thread(
+            lambda: [_enrich_message(item) for item in new_items]
+        )
+        async with self.client.pipeline(transaction=True) as pipe:
+            if history.rewritten:
+                pipe.delete(key)
+            if enriched:
+                pipe.rpush(key, *[json.dumps(m, ensure_ascii=False) for m in enriched])
+            if self.ttl:
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+        history.persisted = len(history.history)
+        history.rewritten = False
+
+    async def migrate_legacy_chat(self, chat_id: str) -> bool:
+        legacy_key = self._history_key(chat_id)
+        key = self._messages_key(chat_id)
+        # Под WATCH, как в RedisChatDB: параллельный перенос не затирает новый ход
+        async with self.client.pipeline() as pipe:
+            try:
+                await pipe.watch(legacy_key, key)
+                if await pipe.exists(key):
+                    return True
+                raw = await pipe.get(legacy_key)
+                pttl = await pipe.pttl(legacy_key)
+                if not raw:
+                    return False
+                try:
+                    items = json.loads(raw)
+                except Exception:
+                    items = []
+
+                # Старый чат лемматизируется целиком, поэтому тоже вне event loop
+                enriched = await asyncio.to_thread(
+                    lambda: [
+                        json.dumps(_enrich_message(m), ensure_ascii=False)
+                        for m in items
+                    ]
+                )
+                pipe.multi()
+                if enriched:
+                    pipe.rpush(key, *enriched)
+                    if pttl and pttl > 0:
+                        pipe.pexpire(key, pttl)
+                pipe.delete(legacy_key)
+                await pipe.execute()
+            except WatchError:
+                return True
+        return bool(items)
+
+    async def clear_chat(self, chat_id: str) -> None:
+        await self.client.delete(
+            self._messages_key(chat_id), self._history_key(chat_id)
+        )
+
+    async def _increment_from(
+        self, stats_key: str, examples_prefix: str, norm: str, phrase: str
+    ) -> None:
+        pruned = await self._increment_with_sample(
+            **increment_args(stats_key, examples_prefix, norm, phrase)
+        )
+        if pruned:
+            async with self.client.pipeline(transaction=False) as pipe:
+                queue_prune(pipe, stats_key, examples_prefix, pruned, time.time())
+                await pipe.execute()
+
+    async def increment_question(self, question: str) -> None:
+        norm = await asyncio.to_thread(normalize_text, question)
+        try:
+            await self._increment_from(
+                self._stats_key(), self.stats_examples_prefix, norm, question
+            )
+        except Exception as e:
+            self.logger.warn(f"Failed to update question stats: {e}")
+
+    async def _top_with_examples_from(
+        self,
+        stats_key: str,
+        examples_prefix: str,
+        limit: int,
+        window: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        pairs = top_pairs(
+            await self._top_entries(
+                keys=window_keys(stats_key, window, time.time()),
+                args=[limit, WINDOW_CACHE_TTL],
+            )
+        )
+        if not pairs:
+            return []
+        async with self.client.pipeline(transaction=False) as pipe:
+            for norm, _ in pairs:
+                await self._read_examples(
+                    keys=[f"{examples_prefix}{norm}"], args=[TOP_EXAMPLES], client=pipe
+                )
+            examples = await pipe.execute()
+        return top_rows(
+            [(norm, score, ex) for (norm, score), ex in zip(pairs, examples)]
+        )
+
+    async def get_top_questions(
+        self, limit: int = 10, window: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        return await self._top_with_examples_from(
+            self._stats_key(), self.stats_examples_prefix, limit, window
+        )
+
+    async def _clear_stats_keys(self, stats_key: str) -> None:
+        # Вместе с общим счётчиком удаляются часовые бакеты и кэш окон
+        keys = [stats_key]
+        async for key in self.client.scan_iter(match=f"{stats_key}:[hw]:*"):
+            keys.append(key)
+        await self.client.delete(*keys)
+
+    async def clear_stats(self) -> None:
+        await self._clear_stats_keys(self._stats_key())
+
+    async def get_theme(self, chat_id: str) -> Optional[str]:
+        return await self.client.get(self._theme_key(chat_id))
+
+    async def get_normalized_theme(self, chat_id: str) -> Optional[str]:
+        try:
+            return await self.client.get(f"{self._theme_key(chat_id)}:normalized")
+        except Exception:
+            return None
+
+    async def save_theme(self, chat_id: str, theme: str) -> None:
+        norm = await asyncio.to_thread(normalize_text, theme)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(self._theme_key(chat_id), theme)
+            pipe.set(f"{self._theme_key(chat_id)}:normalized", norm)
+            await pipe.execute()
+
+    async def increment_theme(self, theme: str) -> None:
+        norm = await asyncio.to_thread(normalize_text, theme)
+        try:
+            await self._increment_from(
+                THEME_STATS_KEY, f"{THEME_EXAMPLES_KEY}:", norm, theme
+            )
+        except Exception as e:
+            self.logger.warn(f"Failed to update theme stats: {e}")
+
+    async def enqueue_theme(self, chat_id: str) -> None:
+        await self.client.sadd(THEME_PENDING_KEY, chat_id)
+
+    async def pop_pending_themes(self, count: int) -> List[str]:
+        return list(await self.client.spop(THEME_PENDING_KEY, count) or [])
+
+    async def add_feedback(self, entry: Dict[str, Any]) -> str:
+        # Приблизительный MAXLEN обрезает stream целыми узлами, XADD остаётся O(1)
+        fields = {k: str(v) for k, v in entry.items() if v is not None}
+        return await self.client.xadd(
+            FEEDBACK_STREAM, fields, maxlen=FEEDBACK_MAXLEN, approximate=True
+        )
+
+    async def get_top_themes(
+        self, limit: int = 10, window: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        return await self._top_with_examples_from(
+            THEME_STATS_KEY, f"{THEME_EXAMPLES_KEY}:", limit, window
+        )
+
+    async def clear_theme_stats(self) -> None:
+        await self._clear_stats_keys(THEME_STATS_KEY)
+
+    async def close(self) -> None:
+        try:
+            await self.client.aclose()
+            await self.pool.aclose()
+        except Exception:
+            pass
@@ -0,0 +1,143 @@
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as qm
+
+from src.services.retrivers.embedder import EmbedClient
+from src.shared.logger import CustomLogger
+
+DEFAULT_COLLECTION = "answer_cache"
+
+
+class QdrantAnswerCache:
+    """
+    Answers to first-turn questions keyed by the question embedding. A new
+    question within the cosine threshold of a cached one gets its answer
+    without retrieval and generation.
+    """
+
+    def __init__(
+        self,
+        vector_size: int,
+        url: str = "http://localhost:6333",
+        api_key: Optional[str] = None,
+        collection: str = DEFAULT_COLLECTION,
+        threshold: float = 0.95,
+        ttl: int = 60 * 60 * 24 * 7,
+        embed_client: Optional[EmbedClient] = None,
+    ) -> None:
+        self.client = QdrantClient(url=url, api_key=api_key)
+        self.collection = collection
+        self.vector_size = vector_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embed_client = embed_client or EmbedClient()
+        self.logger = CustomLogger("qdrant_answer_cache")
+        self.hits = 0
+        self.misses = 0
+        self.ensure_collection()
+
+    def ensure_collection(self) -> None:
+        if self.client.collection_exists(self.collection):
+            return
+        self.client.create_collection(
+            collection_name=self.collection,
+            vectors_config=qm.VectorParams(
+                size=self.vector_size, distance=qm.Distance.COSINE
+            ),
+        )
+        # Фильтр по сроку жизни применяется в каждом поиске
+        self.client.create_payload_index(
+            collection_name=self.collection,
+            field_name="expires_at",
+            field_schema=qm.PayloadSchemaType.FLOAT,
+        )
+
+    @staticmethod
+    def _point_id(question: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_DNS, question.strip().lower()))
+
+    def lookup(self, vector: List[float]) -> Optional[Tuple[str, List[str]]]:
+        not_expired = qm.Filter(
+            must=[qm.FieldCondition(key="expires_at", range=qm.Range(gt=time.time()))]
+        )
+        points = self.client.query_points(
+            collection_name=self.collection,
+            query=vector,
+            query_filter=not_expired,
+            score_threshold=self.threshold,
+            limit=1,
+            with_payload=True,
+        ).points
+        if not points:
+            self.misses += 1
+            return None
+        self.hits += 1
+        payload = points[0].payload or {}
+        self.logger.info(
+            f"Answer cache hit: score {points[0].score:.4f}, "
+            f"cached question: {payload.get('question')}"
+        )
+        return payload.get("answer", ""), payload.get("links", [])
+
+    def store(
+        self, vector: List[float], question: str, answer: str, links: List[str]
+    ) -> None:
+        now = time.time()
+        payload = {
+            "question": question,
+            "answer": answer,
+            "links": links,
+            "created_at": now,
+            "expires_at": now + self.ttl,
+        }
+        point = qm.PointStruct(
+            id=self._point_id(question), vector=vector, payload=payload
+        )
+        self.client.upsert(collection_name=self.collection, points=[point])
+
+    def purge(self, expired_only: bool = False) -> int:
+        before = self.count()
+        if expired_only:
+            expired = qm.Filter(
+                must=[
+                    qm.FieldCondition(key="expires_at", range=qm.Range(lte=time.time()))
+                ]
+            )
+            self.client.delete(
+                collection_name=self.collection,
+                points_selector=qm.FilterSelector(filter=expired),
+            )
+        else:
+            self.client.delete_collection(self.collection)
+            self.ensure_collection()
+        removed = before - self.count()
+        self.logger.info(f"Answer cache purged: {removed} entries removed")
+        return removed
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection, exact=True).count
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            # Счётчики обращений ведёт каждый процесс gateway отдельно
+            "process": {
+                "pid": os.getpid(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            },
+            "entries": self.count(),
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+        }
+
+    def close(self) -> None:
+        try:
+            self.client.close()
+        except Exception:
+            pass
@@ -1,6 +1,7 @@
 import time
+import uuid
 from collections import Counter
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from qdrant_client import QdrantClient
 from qdrant_client.http import models as qm
@@ -28,7 +29,7 @@ class QdrantChatDB:
         self.collection = collection
         self.vector_size = vector_size
         self.distance = distance
-        self.embed_client = EmbedClient()
+        self.embed_client = embed_client or EmbedClient()
         self.logger = CustomLogger("qdrant_chat_db")
 
         if recreate:
@@ -56,6 +57,15 @@ class QdrantChatDB:
                     size=self.vector_size, distance=self.distance
                 ),
             )
+        # По chat_id отзывы находят сообщения ассистента. Индекс досоздаётся
+        # и в коллекциях, заведённых до его появления
+        schema = self.client.get_collection(self.collection).payload_schema or {}
+        if "chat_id" not in schema:
+            self.client.create_payload_index(
+                collection_name=self.collection,
+                field_name="chat_id",
+                field_schema=qm.PayloadSchemaType.KEYWORD,
+            )
 
     @staticmethod
     def _ts() -> float:
@@ -76,7 +86,7 @@ class QdrantChatDB:
         if vector is None:
             if self.embed_client is None:
                 raise RuntimeError("No vector provided and no embed_client configured")
-            vector = self.embed_client.embed(text)
+            vector = self.embed_client.embed_one(text).tolist()
 
         payload = {
             "chat_id": chat_id,
@@ -91,34 +101,65 @@ class QdrantChatDB:
         point = qm.PointStruct(vector=vector, payload=payload)
         self.client.upsert(collection_name=self.collection, points=[point])
 
-    def upsert_messages(self, q_items: list[dict]) -> None:
-        buffer = []
-        for idx, item in enumerate(q_items):
-            if item["role"]:
-                payload = {
-                    "chat_id": item["chat_id"],
-                    "text": item["text"],
-                    "role": item["role"],
-                    "normalized": item.get("normalized"),
-                    "timestamp": item["timestamp"],
-                    "meta": item.get("meta", {}),
-                }
-
-                point_id = item.get("point_id") or idx
-
-                vec = self.embed_client.embed([item["text"]])
-                buffer.append(
-                    qm.PointStruct(
-                        id=point_id,
-                        vector=vec[0]
-                        if isinstance(vec, list) and isinstance(vec[0], list)
-                        else vec,
-                        payload=payload,
-                    )
+    def upsert_messages(self, q_items: list[dict]) -> int:
+        items = [item for item in q_items if item["role"]]
+        # Уже записанные сообщения не перезаписываются: upsert заменил бы payload
+        # целиком и стёр бы response_quality, выставленный по отзыву
+        ids = [item["point_id"] for item in items if item.get("point_id")]
+        if ids:
+            existing = {
+                str(p.id)
+                for p in self.client.retrieve(
+                    collection_name=self.collection,
+                    ids=ids,
+                    with_payload=False,
+                    with_vectors=False,
                 )
+            }
+            items = [item for item in items if item.get("point_id") not in existing]
+        if not items:
+            return 0
+
+        # Прошлые сообщения чата берутся из кэша эмбеддингов,
+        # на сервер уходят только новые тексты
+        vectors = self.embed_client.embed([item["text"] for item in items]).tolist()
+        buffer = []
+        for idx, (item, vec) in enumerate(zip(items, vectors)):
+            payload = {
+                "chat_id": item["chat_id"],
+                "text": item["text"],
+                "role": item["role"],
+                "normalized": item.get("normalized"),
+                "timestamp": item["timestamp"],
+                "meta": item.get("meta", {}),
+            }
+
+            point_id = item.get("point_id") or idx
+
+            buffer.append(qm.PointStruct(id=point_id, vector=vec, payload=payload))
 
-            if buffer:
-                self.client.upsert(collection_name=self.collection, points=buffer)
+        self.client.upsert(collection_name=self.collection, points=buffer)
+        return len(buffer)
+
+    def upsert_themes(self, items: List[Dict[str, Any]]) -> None:
+        if not items:
+            return
+
+        vectors = self.embed_client.embed([item["theme"] for item in items]).tolist()
+        points = []
+        for item, vec in zip(items, vectors):
+            payload = {
+                "chat_id": item["chat_id"],
+                "role": "theme",
+                "theme": item["theme"],
+                "normalized_theme": item["normalized_theme"],
+                "timestamp": item.get("timestamp", self._ts()),
+            }
+            # Одна точка темы на чат, повторная генерация её перезаписывает
+            point_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{item['chat_id']}:theme"))
+            points.append(qm.PointStruct(id=point_id, vector=vec, payload=payload))
+
+        self.client.upsert(collection_name=self.collection, points=points)
 
     def search_similar(
         self,
@@ -129,7 +170,7 @@ class QdrantChatDB:
         if self.embed_client is None:
             raise RuntimeError("embed_client required for semantic search")
 
-        vec = self.embed_client.embed([query])[0]
+        vec = self.embed_client.embed_one(query).tolist()
 
         hits = self.client.search(
             collection_name=self.collection,
@@ -239,6 +280,81 @@ class QdrantChatDB:
             points_selector=qm.PointIdsList(points=[point_id]),
         )
 
+    def _stored_responses(
+        self, items: List[Tuple[str, str, float]]
+    ) -> Set[Tuple[str, str]]:
+        # Одним scroll по всем чатам батча: какие (chat_id, текст) есть в коллекции
+        flt = qm.Filter(
+            must=[
+                qm.FieldCondition(
+                    key="chat_id",
+                    match=qm.MatchAny(any=list({chat_id for chat_id, _, _ in items})),
+                ),
+                qm.FieldCondition(key="role", match=qm.MatchValue(value="assistant")),
+                qm.FieldCondition(
+                    key="text",
+                    match=qm.MatchAny(any=list({text for _, text, _ in items})),
+                ),
+            ]
+        )
+        found: Set[Tuple[str, str]] = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection,
+                scroll_filter=flt,
+                with_payload=["chat_id", "text"],
+                limit=500,
+                offset=offset,
+            )
+            for p in points:
+                payload = p.payload or {}
+                found.add((payload.get("chat_id"), payload.get("text")))
+            if offset is None:
+                break
+        return found
+
+    def update_response_quality_batch(
+        self, items: List[Tuple[str, str, float]]
+    ) -> List[Tuple[str, str, float]]:
+        """
+        Sets response_quality on assistant messages given as
+        (chat_id, response text, quality), all in one batch request.
+        Returns the items that matched no stored message.
+        """
+        if not items:
+            return []
+        stored = self._stored_responses(items)
+        unmatched = [item for item in items if (item[0], item[1]) not in stored]
+        items = [item for item in items if (item[0], item[1]) in stored]
+        if not items:
+            return unmatched
+        operations = [
+            qm.SetPayloadOperation(
+                set_payload=qm.SetPayload(
+                    payload={"response_quality": quality},
+                    filter=qm.Filter(
+                        must=[
+                            qm.FieldCondition(
+                                key="chat_id", match=qm.MatchValue(value=chat_id)
+                            ),
+                            qm.FieldCondition(
+                                key="role", match=qm.MatchValue(value="assistant")
+                            ),
+                            qm.FieldCondition(
+                                key="text", match=qm.MatchValue(value=text)
+                            ),
+                        ]
+                    ),
+                )
+            )
+            for chat_id, text, quality in items
+        ]
+        self.client.batch_update_points(
+            collection_name=self.collection, update_operations=operations
+        )
+        return unmatched
+
     def scroll_points(
         self,
         limit: int = 10000,
@@ -1,34 +1,134 @@
 import json
-import re
-from typing import Any, Dict, List, Optional
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-import pymorphy3
 import redis
 
 from src.services.chat.chat_history import ChatHistory
+from src.services.db.redis_scripts import (
+    INCREMENT_WITH_SAMPLE,
+    READ_EXAMPLES,
+    TOP_ENTRIES,
+)
+from src.shared.logger import CustomLogger
+from src.shared.normalization import normalize_text
 
+# Старый формат: вся история одним JSON. Новый: список, сообщение на элемент
 DEFAULT_HISTORY_PREFIX = "chat:history:"
+DEFAULT_MESSAGES_PREFIX = "chat:messages:"
 DEFAULT_STATS_PREFIX = "chat:stats:"
 DEFAULT_STATS_EXAMPLES_PREFIX = "chat:stats:examples:"
 DEFAULT_THEME_PREFIX = "chat:theme:"
 DEFAULT_TTL = None
 THEME_STATS_KEY = "chat:stats:themes"
 THEME_EXAMPLES_KEY = "chat:stats:themes:examples"
+THEME_PENDING_KEY = "chat:theme:pending"
+# Отзывы пишутся в stream и разбираются FeedbackWorker через consumer group
+FEEDBACK_STREAM = "chat:feedback"
+FEEDBACK_GROUP = "feedback_workers"
+FEEDBACK_MAXLEN = 100000
+# Записи, не подтверждённые за это время (упавший воркер), забирает другой
+FEEDBACK_CLAIM_IDLE_MS = 60 * 1000
+TOP_EXAMPLES = 5
+# Примеры формулировок - резервуар фиксированного размера на normalized ключ.
+# Он больше TOP_EXAMPLES, потому что частые формулировки в нём повторяются
+EXAMPLES_RESERVOIR_SIZE = 16
+# Общий топ держит не больше STATS_MAX_ENTRIES записей; хвост срезается
+# пачкой, когда лишних набирается STATS_PRUNE_SLACK
+STATS_MAX_ENTRIES = 10000
+STATS_PRUNE_SLACK = 1000
+# Часовые бакеты счётчиков для скользящих окон; хранятся чуть дольше самого
+# длинного окна, объединение окна кэшируется на WINDOW_CACHE_TTL секунд.
+# Окно в N часов берёт текущий бакет и N предыдущих, то есть покрывает от N
+# до N + 1 часов: лучше захватить лишнее, чем терять до часа в начале окна
+STATS_WINDOWS = {"1h": 1, "24h": 24, "7d": 24 * 7}
+BUCKET_TTL = 60 * 60 * (24 * 7 + 2)
+WINDOW_CACHE_TTL = 60
 
-_morph = pymorphy3.MorphAnalyzer()
 
+def _hour(ts: float) -> int:
+    return int(ts // 3600)
+
+
+def bucket_key(stats_key: str, hour: int) -> str:
+    return f"{stats_key}:h:{hour}"
+
+
+def window_keys(stats_key: str, window: Optional[str], now: float) -> List[str]:
+    """
+    Keys for TOP_ENTRIES: the all-time set, or the cached union key of the
+    window followed by its hourly buckets, from the current hour back to the
+    one containing now - window (window + 1 buckets).
+    """
+    if window is None:
+        return [stats_key]
+    if window not in STATS_WINDOWS:
+        raise ValueError(f"Unknown stats window '{window}'")
+    hour = _hour(now)
+    buckets = [
+        bucket_key(stats_key, hour - i) for i in range(STATS_WINDOWS[window] + 1)
+    ]
+    return [f"{stats_key}:w:{window}:{hour}"] + buckets
+
+
+def increment_args(
+    stats_key: str, examples_prefix: str, normalized: str, phrase: str
+) -> Dict[str, List[Any]]:
+    """Keys and args for INCREMENT_WITH_SAMPLE."""
+    return {
+        "keys": [
+            stats_key,
+            bucket_key(stats_key, _hour(time.time())),
+            f"{examples_prefix}{normalized}",
+        ],
+        "args": [
+            normalized,
+            phrase,
+            EXAMPLES_RESERVOIR_SIZE,
+            random.random(),
+            BUCKET_TTL,
+            STATS_MAX_ENTRIES,
+            STATS_PRUNE_SLACK,
+        ],
+    }
+
+
+def queue_prune(
+    pipe: Any, stats_key: str, examples_prefix: str, members: List[str], now: float
+) -> None:
+    """
+    Queues removal of entries cut from the all-time top by INCREMENT_WITH_SAMPLE
+    from the hourly buckets still alive and drops their examples.
+    """
+    hour = _hour(now)
+    for i in range(BUCKET_TTL // 3600 + 1):
+        pipe.zrem(bucket_key(stats_key, hour - i), *members)
+    # По одному ключу на команду, чтобы pipeline маршрутизировался по ключам
+    for member in members:
+        pipe.delete(f"{examples_prefix}{member}")
+
+
+def sample_examples(examples: List[Any]) -> List[str]:
+    # В резервуаре формулировки повторяются пропорционально частоте
+    unique = list(dict.fromkeys(m for m in examples if isinstance(m, str)))
+    return random.sample(unique, min(len(unique), TOP_EXAMPLES))
 
-def normalize_text(text: str) -> str:
-    if not text:
-        return ""
-    tokens = re.findall(r"\w+", text.lower())
-    lemmas = []
-    for t in tokens:
-        try:
-            lemmas.append(_morph.parse(t)[0].normal_form)
-        except Exception:
-            lemmas.append(t)
-    return " ".join(lemmas)
+
+def top_pairs(entries: List[Any]) -> List[Tuple[str, Any]]:
+    # ZREVRANGE WITHSCORES из Lua приходит плоским списком member, score, ...
+    return list(zip(entries[::2], entries[1::2]))
+
+
+def top_rows(rows: List[Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "normalized": norm,
+            "count": int(float(score)),
+            "examples": sample_examples(examples),
+        }
+        for norm, score, examples in rows
+    ]
 
 
 def _find_text_field(message: Dict[str, Any]) -> Optional[str]:
@@ -39,6 +139,17 @@ def _find_text_field(message: Dict[str, Any]) -> Optional[str]:
     return None
 
 
+def _enrich_message(item: Any) -> Any:
+    if not isinstance(item, dict):
+        return item
+    msg = item.copy()
+    text_field = _find_text_field(msg)
+    if text_field and "normalized" not in msg:
+        msg["normalized"] = normalize_text(msg.get(text_field, ""))
+    msg.setdefault("timestamp", time.time())
+    return msg
+
+
 class RedisChatDB:
     def __init__(
         self,
@@ -46,13 +157,19 @@ class RedisChatDB:
         history_prefix: str = DEFAULT_HISTORY_PREFIX,
         stats_prefix: str = DEFAULT_STATS_PREFIX,
         ttl: Optional[int] = DEFAULT_TTL,
+        messages_prefix: str = DEFAULT_MESSAGES_PREFIX,
     ) -> None:
         self.client = redis.from_url(redis_url, decode_responses=True)
         self.history_prefix = history_prefix
+        self.messages_prefix = messages_prefix
         self.stats_prefix = stats_prefix
         self.stats_examples_prefix = DEFAULT_STATS_EXAMPLES_PREFIX
         self.theme_prefix = DEFAULT_THEME_PREFIX
         self.ttl = ttl
+        self._top_entries = self.client.register_script(TOP_ENTRIES)
+        self._read_examples = self.client.register_script(READ_EXAMPLES)
+        self._increment_with_sample = self.client.register_script(INCREMENT_WITH_SAMPLE)
+        self.logger = CustomLogger("redis_chat_db")
 
     def _history_key(self, chat_id: str) -> str:
         return f"{self.history_prefix}{chat_id}"
@@ -66,65 +183,147 @@ class RedisChatDB:
     def _theme_key(self, chat_id: str) -> str:
         return f"{self.theme_prefix}{chat_id}"
 
-    def get_chat(self, chat_id: str) -> ChatHistory:
-        raw = self.client.get(self._history_key(chat_id))
-        if raw:
-            try:
-                data = json.loads(raw)
-                return ChatHistory(data)
-            except Exception:
-                return ChatHistory()
-        return ChatHistory()
+    def _messages_key(self, chat_id: str) -> str:
+        return f"{self.messages_prefix}{chat_id}"
 
-    def save_chat(self, chat_id: str, history: ChatHistory) -> None:
+    def get_chat(self, chat_id: str, last: Optional[int] = None) -> ChatHistory:
+        start = -last if last else 0
+        raw = self.client.lrange(self._messages_key(chat_id), start, -1)
+        if not raw and self.migrate_legacy_chat(chat_id):
+            raw = self.client.lrange(self._messages_key(chat_id), start, -1)
         try:
-            enriched: List[Dict[str, Any]] = []
-            for item in history.history:
-                if isinstance(item, dict):
-                    msg = item.copy()
-                    text_field = _find_text_field(msg)
-                    if text_field:
-                        text_val = msg.get(text_field, "")
-                        norm = normalize_text(text_val)
-                        msg["normalized"] = norm
-                    enriched.append(msg)
-                else:
-                    enriched.append(item)
-            payload = json.dumps(enriched, ensure_ascii=False)
+            history = ChatHistory([json.loads(item) for item in raw])
         except Exception:
-            payload = json.dumps(history.history, ensure_ascii=False)
+            return ChatHistory()
+        # Сохранённые сообщения не перезаписываются, save_chat дописывает новые
+        history.persisted = len(history.history)
+        return history
 
-        if self.ttl:
-            self.client.set(self._history_key(chat_id), payload, ex=self.ttl)
+    def save_chat(self, chat_id: str, history: ChatHistory) -> None:
+        key = self._messages_key(chat_id)
+        pipe = self.client.pipeline(transaction=True)
+        if history.rewritten:
+            pipe.delete(key)
+            new_items = history.history
         else:
-            self.client.set(self._history_key(chat_id), payload)
+            new_items = history.history[history.persisted :]
+        if new_items:
+            # Лемматизация и отметка времени один раз, при добавлении сообщения
+            enriched = [_enrich_message(item) for item in new_items]
+            pipe.rpush(key, *[json.dumps(m, ensure_ascii=False) for m in enriched])
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+        history.persisted = len(history.history)
+        history.rewritten = False
+
+    def migrate_legacy_chat(self, chat_id: str) -> bool:
+        """
+        Moves a chat:history:* JSON blob into the list layout keeping its TTL.
+        Returns True if the chat is in the list layout afterwards.
+        """
+        legacy_key = self._history_key(chat_id)
+        key = self._messages_key(chat_id)
+        # WATCH: параллельный первый запрос мог уже перенести чат и дописать ход,
+        # тогда перенос здесь затёр бы его
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(legacy_key, key)
+                if pipe.exists(key):
+                    return True
+                raw = pipe.get(legacy_key)
+                pttl = pipe.pttl(legacy_key)
+                if not raw:
+                    return False
+                try:
+                    items = json.loads(raw)
+                except Exception:
+                    items = []
+
+                pipe.multi()
+                if items:
+                    pipe.rpush(
+                        key,
+                        *[
+                            json.dumps(_enrich_message(m), ensure_ascii=False)
+                            for m in items
+                        ],
+                    )
+                    if pttl and pttl > 0:
+                        pipe.pexpire(key, pttl)
+                pipe.delete(legacy_key)
+                pipe.execute()
+            except redis.WatchError:
+                # Чат перенёс другой запрос, список уже актуален
+                return True
+        return bool(items)
 
     def clear_chat(self, chat_id: str) -> None:
-        self.client.delete(self._history_key(chat_id))
+        self.client.delete(self._messages_key(chat_id), self._history_key(chat_id))
+
+    def _increment_from(
+        self, stats_key: str, examples_prefix: str, norm: str, phrase: str
+    ) -> None:
+        pruned = self._increment_with_sample(
+            **increment_args(stats_key, examples_prefix, norm, phrase)
+        )
+        if pruned:
+            pipe = self.client.pipeline(transaction=False)
+            queue_prune(pipe, stats_key, examples_prefix, pruned, time.time())
+            pipe.execute()
 
     def increment_question(self, question: str) -> None:
         norm = normalize_text(question)
-        self.client.zincrby(self._stats_key(), 1, norm)
+        # Статистика не должна ронять запрос пользователя
         try:
-            self.client.sadd(self._examples_key(norm), question)
-        except Exception:
-            pass
+            self._increment_from(
+                self._stats_key(), self.stats_examples_prefix, norm, question
+            )
+        except Exception as e:
+            self.logger.warn(f"Failed to update question stats: {e}")
 
-    def get_top_questions(self, limit: int = 10) -> List[Dict[str, Any]]:
-        res = self.client.zrevrange(self._stats_key(), 0, limit - 1, withscores=True)
-        out: List[Dict[str, Any]] = []
-        for q, score in res:
-            examples = []
-            try:
-                members = list(self.client.srandmember(self._examples_key(q), 5) or [])
-                examples = [m for m in members if isinstance(m, str)]
-            except Exception:
-                examples = []
-            out.append({"normalized": q, "count": int(score), "examples": examples})
-        return out
+    def _top_with_examples_from(
+        self,
+        stats_key: str,
+        examples_prefix: str,
+        limit: int,
+        window: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        pairs = top_pairs(
+            self._top_entries(
+                keys=window_keys(stats_key, window, time.time()),
+                args=[limit, WINDOW_CACHE_TTL],
+            )
+        )
+        if not pairs:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for norm, _ in pairs:
+            self._read_examples(
+                keys=[f"{examples_prefix}{norm}"], args=[TOP_EXAMPLES], client=pipe
+            )
+        examples = pipe.execute()
+        return top_rows(
+            [(norm, score, ex) for (norm, score), ex in zip(pairs, examples)]
+        )
+
+    def get_top_questions(
+        self, limit: int = 10, window: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        # Топ читается одним скриптом, примеры всех строк - одним pipeline
+        return self._top_with_examples_from(
+            self._stats_key(), self.stats_examples_prefix, limit, window
+        )
+
+    def _clear_stats_keys(self, stats_key: str) -> None:
+        # Вместе с общим счётчиком удаляются часовые бакеты и кэш окон
+        keys = [stats_key]
+        for key in self.client.scan_iter(match=f"{stats_key}:[hw]:*"):
+            keys.append(key)
+        self.client.delete(*keys)
 
     def clear_stats(self) -> None:
-        self.client.delete(self._stats_key())
+        self._clear_stats_keys(self._stats_key())
 
     def get_theme(self, chat_id: str) -> Optional[str]:
         return self.client.get(self._theme_key(chat_id))
@@ -145,34 +344,59 @@ class RedisChatDB:
 
     def increment_theme(self, theme: str) -> None:
         norm = normalize_text(theme)
-        self.client.zincrby(self.THEME_STATS_KEY, 1, norm)
         try:
-            self.client.sadd(f"{self.THEME_EXAMPLES_KEY}:{norm}", theme)
-        except Exception:
-            pass
+            self._increment_from(THEME_STATS_KEY, f"{THEME_EXAMPLES_KEY}:", norm, theme)
+        except Exception as e:
+            self.logger.warn(f"Failed to update theme stats: {e}")
 
-    def get_top_themes(self, limit: int = 10) -> List[Dict[str, Any]]:
-        res = self.client.zrevrange(THEME_STATS_KEY, 0, limit - 1, withscores=True)
-        out: List[Dict[str, Any]] = []
-        for theme_norm, score in res:
-            examples = []
-            try:
-                members = list(
-                    self.client.srandmember(
-                        f"{THEME_EXAMPLES_KEY}:{theme_norm}", 5
-                    )
-                    or []
-                )
-                examples = [m for m in members if isinstance(m, str)]
-            except Exception:
-                examples = []
-            out.append(
-                {"normalized": theme_norm, "count": int(score), "examples": examples}
+    def enqueue_theme(self, chat_id: str) -> None:
+        # Множество, а не список: повторные запросы чата не дублируют задачу
+        self.client.sadd(THEME_PENDING_KEY, chat_id)
+
+    def pop_pending_themes(self, count: int) -> List[str]:
+        return list(self.client.spop(THEME_PENDING_KEY, count) or [])
+
+    def ensure_feedback_group(self) -> None:
+        try:
+            self.client.xgroup_create(
+                FEEDBACK_STREAM, FEEDBACK_GROUP, id="0", mkstream=True
             )
-        return out
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read_feedback(
+        self, consumer: str, count: int
+    ) -> List[Tuple[str, Dict[str, str]]]:
+        # Сначала зависшие записи (свои после ошибки или чужие после падения),
+        # затем новые
+        _, entries, *_ = self.client.xautoclaim(
+            FEEDBACK_STREAM,
+            FEEDBACK_GROUP,
+            consumer,
+            min_idle_time=FEEDBACK_CLAIM_IDLE_MS,
+            count=count,
+        )
+        if entries:
+            return entries
+        streams = self.client.xreadgroup(
+            FEEDBACK_GROUP, consumer, {FEEDBACK_STREAM: ">"}, count=count
+        )
+        return streams[0][1] if streams else []
+
+    def ack_feedback(self, entry_ids: List[str]) -> None:
+        if entry_ids:
+            self.client.xack(FEEDBACK_STREAM, FEEDBACK_GROUP, *entry_ids)
+
+    def get_top_themes(
+        self, limit: int = 10, window: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        return self._top_with_examples_from(
+            THEME_STATS_KEY, f"{THEME_EXAMPLES_KEY}:", limit, window
+        )
 
     def clear_theme_stats(self) -> None:
-        self.client.delete(THEME_STATS_KEY)
+        self._clear_stats_keys(THEME_STATS_KEY)
 
     def close(self) -> None:
         try:
@@ -0,0 +1,67 @@
+# Lua-скрипты статистики. Скрипты обращаются только к ключам из KEYS, поэтому
+# их можно маршрутизировать по ключам (прокси, Cluster). Примеры читаются
+# отдельным одноключевым вызовом на строку топа, в одном pipeline с остальными
+
+# KEYS[1] - sorted set счётчиков. Если переданы KEYS[2..] (часовые бакеты окна),
+# а KEYS[1] ещё нет, он собирается из них ZUNIONSTORE и живёт ARGV[2] секунд.
+# ARGV: limit, TTL объединения
+TOP_ENTRIES = """
+if #KEYS > 1 and redis.call('EXISTS', KEYS[1]) == 0 then
+    local buckets = {}
+    for i = 2, #KEYS do
+        buckets[#buckets + 1] = KEYS[i]
+    end
+    redis.call('ZUNIONSTORE', KEYS[1], #buckets, unpack(buckets))
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+"""
+
+# KEYS[1] - ключ примеров. Примеры, записанные до резервуара, ещё лежат в set.
+# ARGV: число примеров для set
+READ_EXAMPLES = """
+if redis.call('TYPE', KEYS[1]).ok == 'list' then
+    return redis.call('LRANGE', KEYS[1], 0, -1)
+end
+return redis.call('SRANDMEMBER', KEYS[1], tonumber(ARGV[1]))
+"""
+
+# Счётчик + часовой бакет + reservoir sampling примеров (Algorithm R) за один вызов.
+# Счётчиком резервуара служит сам общий счёт, случайное число передаёт клиент.
+# Когда в общем топе становится больше ARGV[6] + ARGV[7] записей, хвост с
+# наименьшими счётами срезается до ARGV[6]. Срезанные записи возвращаются:
+# их бакеты и примеры клиент удаляет сам, скрипт трогает только ключи из KEYS.
+# KEYS: общий sorted set, часовой бакет, список примеров
+# ARGV: normalized, исходная фраза, размер резервуара, random [0, 1),
+#       TTL бакета, лимит записей, запас до обрезки
+INCREMENT_WITH_SAMPLE = """
+local n = tonumber(redis.call('ZINCRBY', KEYS[1], 1, ARGV[1]))
+redis.call('ZINCRBY', KEYS[2], 1, ARGV[1])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[5]))
+
+local size = tonumber(ARGV[3])
+if redis.call('TYPE', KEYS[3]).ok == 'set' then
+    local legacy = redis.call('SRANDMEMBER', KEYS[3], size)
+    redis.call('DEL', KEYS[3])
+    if #legacy > 0 then
+        redis.call('RPUSH', KEYS[3], unpack(legacy))
+    end
+end
+if redis.call('LLEN', KEYS[3]) < size then
+    redis.call('RPUSH', KEYS[3], ARGV[2])
+else
+    local j = math.floor(tonumber(ARGV[4]) * n)
+    if j < size then
+        redis.call('LSET', KEYS[3], j, ARGV[2])
+    end
+end
+
+local max_entries = tonumber(ARGV[6])
+local card = redis.call('ZCARD', KEYS[1])
+if card > max_entries + tonumber(ARGV[7]) then
+    local tail = redis.call('ZRANGE', KEYS[1], 0, card - max_entries - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, card - max_entries - 1)
+    return tail
+end
+return {}
+"""
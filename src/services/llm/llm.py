@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, Iterator, List
 
 from openai import OpenAI
 
@@ -25,3 +25,18 @@ class VllmClient:
         )
         answer = response.choices[0].message.content
         return answer
+
+    def generate_stream(self, chat_history: List[Dict[str, str]]) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=chat_history,
+            temperature=config.temperature,
+            max_tokens=config.max_tokens,
+            stream=True,
+            extra_body={"chat_template_kwargs": {"thinking": False}},
+        )
+        # Закрытие генератора закрывает HTTP-ответ, и vLLM прекращает генерацию
+        with stream:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
@@ -1,30 +1,98 @@
+import dataclasses
+import queue
 import re
+import resource
+import sys
+import threading
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 from haystack import Document, component
 
+from src.services.retrivers.index_manifest import chunk_hash
+from src.shared import config
+from src.shared.tokenizer import get_tokenizer
+
+T = TypeVar("T")
+
+
+def read_document(file_path: Path, source_path: str) -> Optional[Document]:
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            url = file.readline().strip()
+            content = file.read()
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+    return Document(
+        content=content,
+        meta={"name": file_path.name, "common_url": url, "source_path": source_path},
+    )
+
+
+def iter_documents(source: Path) -> Iterator[Document]:
+    for file_path in source.rglob("*.*"):
+        if not file_path.is_file():
+            continue
+        doc = read_document(file_path, file_path.relative_to(source).as_posix())
+        if doc is not None:
+            yield doc
+
+
+def prefetch(items: Iterable[T], depth: int) -> Iterator[T]:
+    """Produces items in a background thread, keeping at most `depth` ready."""
+    buffer: queue.Queue = queue.Queue(maxsize=max(depth, 1))
+    done = object()
+    errors: List[BaseException] = []
+    # Если потребитель упал или бросил итерацию, поток не должен навсегда
+    # зависнуть на заполненной очереди
+    stop = threading.Event()
+
+    def put(item: object) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
 
 @component
 class DocumentReader:
     @component.output_types(out=List[Document])
     def run(self, source: Path) -> Dict[str, List[Document]]:
-        all_files = list(source.rglob("*.*"))
-        documents = []
-        for file_path in all_files:
-            try:
-                with open(file_path, "r", encoding="utf-8") as file:
-                    url = file.readline().strip()
-                    content = file.read()
-                    documents.append(
-                        Document(
-                            content=content,
-                            meta={"name": file_path.name, "common_url": url},
-                        )
-                    )
-            except Exception as e:
-                print(f"Error reading {file_path}: {e}")
-        return {"out": documents}
+        return {"out": list(iter_documents(source))}
 
 
 @component
@@ -48,15 +116,135 @@ class LinkFinder:
         return {"out": docs}
 
 
+@component
+class ChunkFilter:
+    """
+    Assigns content-hash ids to chunks and drops repeated chunks of a file.
+
+    All chunks of a changed file are passed on, including the ones already
+    indexed: their split_id and other meta may have shifted, and the merge of
+    adjacent chunks relies on it. Their vectors come from the embedding cache.
+    """
+
+    @component.output_types(out=List[Document], chunk_ids=Dict[str, List[str]])
+    def run(self, docs: List[Document]) -> Dict[str, object]:
+        chunk_ids: Dict[str, List[str]] = {}
+        out: List[Document] = []
+        for doc in docs:
+            source_path = doc.meta.get("source_path") or doc.meta.get("name", "")
+            # Новый Document вместо присваивания id: Haystack предупреждает о
+            # смене id существующего документа
+            doc = dataclasses.replace(
+                doc, id=chunk_hash(source_path, doc.content or "")
+            )
+            ids = chunk_ids.setdefault(source_path, [])
+            if doc.id in ids:
+                continue
+            ids.append(doc.id)
+            out.append(doc)
+        return {"out": out, "chunk_ids": chunk_ids}
+
+
+def _overlap_words(left: List[str], right: List[str], max_overlap: int) -> int:
+    # Длина самого длинного суффикса left, совпадающего с префиксом right
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left[-size:] == right[:size]:
+            return size
+    return 0
+
+
+def merge_adjacent_chunks(
+    documents: List[Document], max_overlap: int = 100
+) -> List[Tuple[float, List[Document], str]]:
+    """
+    Groups chunks of the same source file with consecutive split_id into
+    passages and removes the words repeated by the splitter overlap.
+    Returns (score, chunks, text) ordered by the best chunk score.
+    """
+    groups: Dict[str, List[Tuple[int, Document]]] = {}
+    for rank, doc in enumerate(documents):
+        source = doc.meta.get("source_path")
+        # Без source_path/split_id соседство не определить, чанк идёт как есть
+        key = source if source and doc.meta.get("split_id") is not None else doc.id
+        groups.setdefault(key, []).append((rank, doc))
+
+    passages: List[Tuple[float, int, List[Document], str]] = []
+    for items in groups.values():
+        items.sort(key=lambda item: item[1].meta.get("split_id") or 0)
+        run: List[Tuple[int, Document]] = []
+        words: List[str] = []
+        for rank, doc in items:
+            doc_words = (doc.content or "").split()
+            prev = run[-1][1] if run else None
+            if (
+                prev is not None
+                and doc.meta.get("split_id") == (prev.meta.get("split_id") or 0) + 1
+            ):
+                words += doc_words[_overlap_words(words, doc_words, max_overlap) :]
+                run.append((rank, doc))
+                continue
+            if run:
+                passages.append(_passage(run, words))
+            run, words = [(rank, doc)], doc_words
+        if run:
+            passages.append(_passage(run, words))
+
+    passages.sort(key=lambda passage: (-passage[0], passage[1]))
+    return [(score, docs, text) for score, _, docs, text in passages]
+
+
+def _passage(
+    run: List[Tuple[int, Document]], words: List[str]
+) -> Tuple[float, int, List[Document], str]:
+    score = max((doc.score or 0.0) for _, doc in run)
+    best_rank = min(rank for rank, _ in run)
+    return score, best_rank, [doc for _, doc in run], " ".join(words)
+
+
 @component
 class DocumentCombiner:
-    @component.output_types(out=str, context=List[Document])
+    """
+    Builds the retrieval context: merges adjacent chunks of one source without
+    the splitter overlap and packs passages by score into max_tokens tokens
+    of the generation model.
+    """
+
+    def __init__(self, max_tokens: int = config.context_max_tokens) -> None:
+        self.max_tokens = max_tokens
+
+    @component.output_types(out=str, context=List[Document], stats=Dict[str, int])
     def run(self, documents: List[Document]) -> Dict[str, object]:
+        tokenizer = get_tokenizer()
+        input_tokens = sum(
+            len(tokenizer.encode(doc.content or "", add_special_tokens=False))
+            for doc in documents
+        )
+
+        texts: List[str] = []
+        context: List[Document] = []
+        retained = 0
+        for _, docs, text in merge_adjacent_chunks(documents):
+            tokens = tokenizer.encode(text, add_special_tokens=False)
+            remaining = self.max_tokens - retained
+            if len(tokens) > remaining:
+                if texts:
+                    continue
+                # Самый релевантный фрагмент не влез целиком, берём его начало
+                tokens = tokens[:remaining]
+                text = tokenizer.decode(tokens)
+            texts.append(text)
+            context.extend(docs)
+            retained += len(tokens)
+
         combined_content = "\n\n".join(
-            [
-                f"Документ номер {i + 1}: {doc.content}"
-                for i, doc in enumerate(documents)
-            ]
+            [f"Документ номер {i + 1}: {text}" for i, text in enumerate(texts)]
         )
         prompt = f"Вот документы, которые могут помочь ответить на вопрос:\n\n{combined_content}"
-        return {"out": prompt, "context": documents}
+        stats = {
+            "input_tokens": input_tokens,
+            "retained_tokens": retained,
+            "dropped_tokens": input_tokens - retained,
+            "documents": len(documents),
+            "passages": len(texts),
+        }
+        return {"out": prompt, "context": context, "stats": stats}
@@ -1,32 +1,287 @@
-from typing import Dict, List
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import requests
 from haystack import Document, component
+from haystack.dataclasses import SparseEmbedding
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
-from src.shared.config import embedding_server_url
+from src.services.retrivers.embedding_cache import (
+    EmbeddingCache,
+    default_embedding_cache,
+)
+from src.shared import config
+from src.shared.config import embedding_hybrid_server_url, embedding_server_url
+
+# Бинарный формат ответа сервера эмбеддингов (run_servers/embed):
+# заголовок (magic, код dtype, строки, размерность) и матрица little-endian
+BINARY_MAGIC = b"EMB1"
+BINARY_HEADER = struct.Struct("<4sIII")
+BINARY_DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+WIRE_FORMATS = {
+    "json": "application/json",
+    "float32": "application/x-embeddings-f32, application/json;q=0.5",
+    "float16": "application/x-embeddings-f16, application/json;q=0.5",
+}
+
+
+SparseRow = Tuple[np.ndarray, np.ndarray]
+
+
+def _is_binary(response: requests.Response) -> bool:
+    content_type = response.headers.get("Content-Type", "")
+    return content_type.startswith("application/x-embeddings")
+
+
+def _unpack_matrix(content: bytes) -> Tuple[np.ndarray, int]:
+    magic, code, rows, dim = BINARY_HEADER.unpack_from(content)
+    if magic != BINARY_MAGIC or code not in BINARY_DTYPES:
+        raise ValueError(f"Unexpected embeddings payload: {magic!r}, dtype {code}")
+    dtype = BINARY_DTYPES[code]
+    vectors = np.frombuffer(
+        content, dtype=dtype, count=rows * dim, offset=BINARY_HEADER.size
+    )
+    return vectors.reshape(rows, dim), BINARY_HEADER.size + rows * dim * dtype.itemsize
+
+
+def decode_embeddings(response: requests.Response) -> np.ndarray:
+    if not _is_binary(response):
+        return np.asarray(response.json()["embeddings"], dtype=np.float32)
+    return _unpack_matrix(response.content)[0]
+
+
+def decode_hybrid(response: requests.Response) -> Tuple[np.ndarray, List[SparseRow]]:
+    if not _is_binary(response):
+        data = response.json()
+        sparse = [
+            (
+                np.asarray(item["indices"], dtype=np.int32),
+                np.asarray(item["values"], dtype=np.float32),
+            )
+            for item in data["sparse"]
+        ]
+        return np.asarray(data["embeddings"], dtype=np.float32), sparse
+    # За плотной матрицей: число весов по строкам, индексы и веса подряд
+    content = response.content
+    dense, offset = _unpack_matrix(content)
+    rows = dense.shape[0]
+    nnz = np.frombuffer(content, dtype="<u4", count=rows, offset=offset)
+    total = int(nnz.sum())
+    offset += rows * 4
+    indices = np.frombuffer(content, dtype="<i4", count=total, offset=offset)
+    values = np.frombuffer(content, dtype="<f4", count=total, offset=offset + total * 4)
+    bounds = np.cumsum(nnz)[:-1]
+    return dense, list(zip(np.split(indices, bounds), np.split(values, bounds)))
 
 
 class EmbedClient:
-    def __init__(self, url: str = embedding_server_url, batch_size: int = 16) -> None:
+    """
+    Клиент сервера эмбеддингов.
+
+    Батчи ограничены суммарной длиной текстов (max_batch_chars) и числом
+    текстов (batch_size), до max_in_flight батчей отправляются параллельно
+    через пул keep-alive соединений. Порядок эмбеддингов совпадает с порядком
+    входных текстов. Уже посчитанные эмбеддинги берутся из EmbeddingCache,
+    на сервер уходят только промахи.
+    """
+
+    def __init__(
+        self,
+        url: str = embedding_server_url,
+        hybrid_url: str = embedding_hybrid_server_url,
+        batch_size: int = config.embed_batch_size,
+        max_batch_chars: int = config.embed_max_batch_chars,
+        max_in_flight: int = config.embed_max_in_flight,
+        timeout: float = 60,
+        wire_format: str = config.embed_wire_format,
+        cache: Optional[EmbeddingCache] = None,
+        use_cache: bool = config.embed_cache_enabled,
+    ) -> None:
         self.url = url
+        self.hybrid_url = hybrid_url
+        self.cache = (cache or default_embedding_cache()) if use_cache else None
         self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.max_in_flight = max(max_in_flight, 1)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_in_flight, max_retries=2
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Content-Type": "application/json", "Accept": WIRE_FORMATS[wire_format]}
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="embed"
+        )
 
-    def embed(self, texts: List[str]) -> List[List[float]]:
-        embeddings: List[List[float]] = []
-        for i in tqdm(range(0, len(texts), self.batch_size)):
-            batch = texts[i : i + self.batch_size]
-            response = requests.post(
-                self.url,
-                json={"texts": batch},
-                headers={"Content-Type": "application/json"},
-                timeout=60,
-            )
-            response.raise_for_status()
-            data = response.json()
-            embeddings.extend(data["embeddings"])
+    def _batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        spans: List[Tuple[int, int]] = []
+        start = 0
+        chars = 0
+        for i, text in enumerate(texts):
+            size = len(text)
+            if i > start and (
+                i - start >= self.batch_size or chars + size > self.max_batch_chars
+            ):
+                spans.append((start, i))
+                start, chars = i, 0
+            chars += size
+        if start < len(texts):
+            spans.append((start, len(texts)))
+        return spans
+
+    def _post(self, batch: List[str]) -> np.ndarray:
+        response = self.session.post(
+            self.url, json={"texts": batch}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        # Матрица остаётся numpy до границы с Haystack/Qdrant
+        return decode_embeddings(response)
+
+    def _post_hybrid(self, batch: List[str]) -> Tuple[np.ndarray, List[SparseRow]]:
+        response = self.session.post(
+            self.hybrid_url, json={"texts": batch}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return decode_hybrid(response)
+
+    def embed_hybrid(
+        self, texts: List[str], show_progress: bool = False
+    ) -> Tuple[np.ndarray, List[SparseEmbedding]]:
+        """Dense vectors and bge-m3 lexical weights from one forward pass."""
+        if self.cache is not None:
+            cached = self.cache.get_hybrid_many(texts)
+        else:
+            cached = [None] * len(texts)
+        missing = [i for i, item in enumerate(cached) if item is None]
+        to_embed = [texts[i] for i in missing]
+
+        results = self._executor.map(
+            lambda span: self._post_hybrid(to_embed[slice(*span)]),
+            self._batches(to_embed),
+        )
+        if show_progress:
+            results = tqdm(results)
+        dense_batches: List[np.ndarray] = []
+        sparse: List[SparseRow] = []
+        for batch_dense, batch_sparse in results:
+            dense_batches.append(batch_dense)
+            sparse.extend(batch_sparse)
+        computed = (
+            np.concatenate(dense_batches)
+            if dense_batches
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        if self.cache is not None and missing:
+            self.cache.put_hybrid_many(to_embed, computed, sparse)
+
+        dense = [item[0] if item is not None else None for item in cached]
+        rows = [item[1] if item is not None else None for item in cached]
+        for i, row in zip(missing, sparse):
+            rows[i] = row
+        return self._merge(dense, missing, computed), [
+            SparseEmbedding(indices=indices.tolist(), values=values.tolist())
+            for indices, values in rows
+        ]
+
+    def _embed_remote(
+        self, texts: List[str], show_progress: bool = False
+    ) -> np.ndarray:
+        spans = self._batches(texts)
+        if not spans:
+            return np.empty((0, 0), dtype=np.float32)
+        if len(spans) == 1:
+            return self._post(texts)
+
+        results = self._executor.map(
+            lambda span: self._post(texts[slice(*span)]), spans
+        )
+        if show_progress:
+            results = tqdm(results, total=len(spans))
+        return np.concatenate(list(results))
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        if self.cache is None:
+            return [None] * len(texts), list(range(len(texts)))
+        cached = self.cache.get_many(texts)
+        return cached, [i for i, emb in enumerate(cached) if emb is None]
+
+    def _fill(
+        self,
+        texts: List[str],
+        cached: List[Optional[np.ndarray]],
+        missing: List[int],
+        computed: np.ndarray,
+    ) -> np.ndarray:
+        if self.cache is not None and missing:
+            self.cache.put_many([texts[i] for i in missing], computed)
+        return self._merge(cached, missing, computed)
+
+    @staticmethod
+    def _merge(
+        cached: List[Optional[np.ndarray]], missing: List[int], computed: np.ndarray
+    ) -> np.ndarray:
+        if len(missing) == len(cached):
+            return computed.astype(np.float32, copy=False)
+        dim = computed.shape[1] if missing else len(cached[0])
+        embeddings = np.empty((len(cached), dim), dtype=np.float32)
+        for i, emb in enumerate(cached):
+            if emb is not None:
+                embeddings[i] = emb
+        if missing:
+            embeddings[missing] = computed
         return embeddings
 
+    def embed_one(self, text: str) -> np.ndarray:
+        if self.cache is not None:
+            cached = self.cache.get_many([text])[0]
+            if cached is not None:
+                return cached
+        embedding = self._post([text])[0].astype(np.float32, copy=False)
+        if self.cache is not None:
+            self.cache.put_many([text], [embedding])
+        return embedding
+
+    def embed(self, texts: List[str], show_progress: bool = False) -> np.ndarray:
+        cached, missing = self._lookup(texts)
+        computed = self._embed_remote([texts[i] for i in missing], show_progress)
+        return self._fill(texts, cached, missing, computed)
+
+    async def aembed_one(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_one, text)
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        cached, missing = await loop.run_in_executor(None, self._lookup, texts)
+        to_embed = [texts[i] for i in missing]
+        batches = await asyncio.gather(
+            *[
+                loop.run_in_executor(self._executor, self._post, to_embed[slice(*span)])
+                for span in self._batches(to_embed)
+            ]
+        )
+        computed = (
+            np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        )
+        return await loop.run_in_executor(
+            None, self._fill, texts, cached, missing, computed
+        )
+
+    def cache_stats(self) -> Dict[str, float]:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
 
 @component
 class DocEmbedder:
@@ -36,8 +291,9 @@ class DocEmbedder:
     @component.output_types(documents=List[Document])
     def run(self, documents: List[Document]) -> Dict[str, List[Document]]:
         texts = [doc.content for doc in documents]
-        embeddings = self.embed_client.embed(texts)
-        for doc, emb in zip(documents, embeddings):
+        embeddings = self.embed_client.embed(texts, show_progress=True)
+        # Haystack и Qdrant ждут списки float, numpy заканчивается здесь
+        for doc, emb in zip(documents, embeddings.tolist()):
             doc.embedding = emb
         return {"documents": documents}
 
@@ -50,13 +306,39 @@ class QueryEmbedder:
     @component.output_types(embedding=List[float])
     def run(self, query: str) -> Dict[str, List[float]]:
         print(f"Generating embedding for query: {query}")
-        embedding = self.embed_client.embed([query])[0]
-        return {"embedding": embedding}
+        embedding = self.embed_client.embed_one(query)
+        return {"embedding": embedding.tolist()}
+
+
+@component
+class HybridDocEmbedder:
+    def __init__(self, embed_client: EmbedClient) -> None:
+        self.embed_client = embed_client
+
+    @component.output_types(documents=List[Document])
+    def run(self, documents: List[Document]) -> Dict[str, List[Document]]:
+        texts = [doc.content for doc in documents]
+        embeddings, sparse = self.embed_client.embed_hybrid(texts, show_progress=True)
+        for doc, emb, sparse_emb in zip(documents, embeddings.tolist(), sparse):
+            doc.embedding = emb
+            doc.sparse_embedding = sparse_emb
+        return {"documents": documents}
+
+
+@component
+class HybridQueryEmbedder:
+    def __init__(self, embed_client: EmbedClient) -> None:
+        self.embed_client = embed_client
+
+    @component.output_types(embedding=List[float], sparse_embedding=SparseEmbedding)
+    def run(self, query: str) -> Dict[str, object]:
+        embeddings, sparse = self.embed_client.embed_hybrid([query])
+        return {"embedding": embeddings[0].tolist(), "sparse_embedding": sparse[0]}
 
 
 if __name__ == "__main__":
     client = EmbedClient(batch_size=512)
     texts = [f"текст {i}" for i in range(10000)]
-    vectors = client.embed(texts)
+    vectors = client.embed(texts, show_progress=True)
     print(f"Получено {len(vectors)} эмбеддингов")
     print("Размер одного эмбеддинга:", len(vectors[0]))
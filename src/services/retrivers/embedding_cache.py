@@ -0,0 +1,238 @@
+import hashlib
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.shared import config
+
+VECTOR_DTYPE = np.dtype("<f4")
+# Пара dense + sparse хранится одной строкой: (dim, nnz), вектор, индексы, веса
+HYBRID_HEADER = struct.Struct("<II")
+HYBRID_KIND = "hybrid"
+# Время доступа на диске обновляется не чаще раза в ACCESS_REFRESH_SECONDS:
+# вытеснению точность до минут не нужна, а чтение не берёт транзакцию записи
+ACCESS_REFRESH_SECONDS = 10 * 60
+
+HybridEntry = Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]
+
+
+def _pack_hybrid(vector: np.ndarray, indices: np.ndarray, values: np.ndarray) -> bytes:
+    return (
+        HYBRID_HEADER.pack(len(vector), len(indices))
+        + np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+        + np.asarray(indices, dtype="<i4").tobytes()
+        + np.asarray(values, dtype=VECTOR_DTYPE).tobytes()
+    )
+
+
+def _unpack_hybrid(blob: bytes) -> HybridEntry:
+    dim, nnz = HYBRID_HEADER.unpack_from(blob)
+    offset = HYBRID_HEADER.size
+    vector = np.frombuffer(blob, dtype=VECTOR_DTYPE, count=dim, offset=offset)
+    offset += dim * 4
+    indices = np.frombuffer(blob, dtype="<i4", count=nnz, offset=offset)
+    values = np.frombuffer(blob, dtype=VECTOR_DTYPE, count=nnz, offset=offset + nnz * 4)
+    return vector, (indices, values)
+
+
+def _unpack_dense(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=VECTOR_DTYPE)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache: in-process LRU in front of a SQLite file.
+
+    Keys are derived from the model name, the server backend, the output
+    dimension and the text, so switching any of them never returns stale
+    vectors. Dense vectors from /embed and dense + sparse pairs from
+    /embed_hybrid are separate entries. The file is trimmed to max_bytes by
+    evicting the least recently used entries.
+    """
+
+    def __init__(
+        self,
+        path: Path = Path(config.embed_cache_path),
+        model_name: str = config.embedding_model_name,
+        backend: str = config.embedding_backend,
+        dim: int = config.embedding_model_dim,
+        max_bytes: int = config.embed_cache_max_bytes,
+        lru_size: int = config.embed_cache_lru_size,
+    ) -> None:
+        self.path = Path(path)
+        self.model_name = model_name
+        self.backend = backend
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self._memory: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings(accessed)"
+        )
+        self._db.commit()
+        self._size = self._disk_size()
+
+    def key(self, text: str, kind: str = "") -> str:
+        raw = f"{self.model_name}\0{self.backend}\0{self.dim}\0{text}"
+        if kind:
+            raw = f"{kind}\0{raw}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_size(self) -> int:
+        row = self._db.execute("SELECT SUM(LENGTH(vector)) FROM embeddings").fetchone()
+        return int(row[0] or 0)
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.lru_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        return self._get([self.key(text) for text in texts], _unpack_dense)
+
+    def get_hybrid_many(self, texts: List[str]) -> List[Optional[HybridEntry]]:
+        keys = [self.key(text, HYBRID_KIND) for text in texts]
+        return self._get(keys, _unpack_hybrid)
+
+    def _get(self, keys: List[str], unpack: Callable[[bytes], Any]) -> List[Any]:
+        found: Dict[str, Any] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.memory_hits += 1
+
+            now = time.time()
+            stale = []
+            unique_missing = list(dict.fromkeys(missing))
+            for i in range(0, len(unique_missing), 500):
+                chunk = unique_missing[i : i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector, accessed FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, blob, accessed in rows:
+                    value = unpack(blob)
+                    found[key] = value
+                    self._remember(key, value)
+                    if now - accessed > ACCESS_REFRESH_SECONDS:
+                        stale.append((now, key))
+            if stale:
+                self._db.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE key = ?", stale
+                )
+                self._db.commit()
+
+            result = [found.get(key) for key in keys]
+            hits = sum(v is not None for v in result)
+            self.hits += hits
+            self.misses += len(result) - hits
+        return result
+
+    def put_many(self, texts: List[str], vectors: Sequence[np.ndarray]) -> None:
+        entries = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+            # Значение читается из своих байтов, чтобы LRU не держал весь
+            # буфер ответа сервера
+            entries.append((self.key(text), _unpack_dense(blob), blob))
+        self._put(entries)
+
+    def put_hybrid_many(
+        self,
+        texts: List[str],
+        vectors: Sequence[np.ndarray],
+        sparse: Sequence[Tuple[np.ndarray, np.ndarray]],
+    ) -> None:
+        entries = []
+        for text, vector, (indices, values) in zip(texts, vectors, sparse):
+            blob = _pack_hybrid(vector, indices, values)
+            entries.append((self.key(text, HYBRID_KIND), _unpack_hybrid(blob), blob))
+        self._put(entries)
+
+    def _put(self, entries: List[Tuple[str, Any, bytes]]) -> None:
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, value, blob in entries:
+                self._remember(key, value)
+                rows.append((key, blob, now))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+            self._size += sum(len(row[1]) for row in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Размер пересчитывается по файлу: кэш могут делить несколько процессов
+        self._size = self._disk_size()
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = self._db.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings "
+                "ORDER BY accessed LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._size <= target:
+                    break
+                evicted.append(key)
+                self._memory.pop(key, None)
+                self._size -= size
+            self._db.executemany(
+                "DELETE FROM embeddings WHERE key = ?", [(key,) for key in evicted]
+            )
+        self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._size,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+@lru_cache(maxsize=None)
+def default_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache()
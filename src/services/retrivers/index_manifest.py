@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(source_path: str, content: str) -> str:
+    return hashlib.sha256(f"{source_path}\n{content}".encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    Local record of what is stored in the document index: for every source file
+    its content hash and the ids of the chunks written for it.
+
+    The manifest is rewritten atomically after every indexed batch, so it also
+    acts as the checkpoint of an interrupted run.
+    """
+
+    def __init__(self, path: Path, signature: str = "") -> None:
+        self.path = Path(path)
+        self.signature = signature
+        self.files: Dict[str, Dict[str, object]] = {}
+        self.load()
+
+    def load(self) -> None:
+        if not self.path.exists():
+            self.files = {}
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if (
+            data.get("version") != MANIFEST_VERSION
+            or data.get("signature", "") != self.signature
+        ):
+            self.files = {}
+            return
+        self.files = data.get("files", {})
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "signature": self.signature,
+                    "files": self.files,
+                },
+                file,
+                ensure_ascii=False,
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def reset(self) -> None:
+        self.files = {}
+        self.save()
+
+    def is_empty(self) -> bool:
+        return not self.files
+
+    def file_hash(self, source_path: str) -> Optional[str]:
+        entry = self.files.get(source_path)
+        return entry["hash"] if entry else None
+
+    def chunk_ids(self, source_path: str) -> List[str]:
+        entry = self.files.get(source_path)
+        return list(entry["chunks"]) if entry else []
+
+    def known_chunk_ids(self, source_paths: List[str]) -> Set[str]:
+        known: Set[str] = set()
+        for source_path in source_paths:
+            known.update(self.chunk_ids(source_path))
+        return known
+
+    def update(self, source_path: str, digest: str, chunk_ids: List[str]) -> None:
+        self.files[source_path] = {"hash": digest, "chunks": list(chunk_ids)}
+
+    def remove(self, source_path: str) -> List[str]:
+        entry = self.files.pop(source_path, None)
+        return list(entry["chunks"]) if entry else []
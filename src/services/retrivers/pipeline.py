@@ -1,9 +1,13 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from haystack import Document, Pipeline
 from haystack.components.preprocessors import DocumentSplitter
 from haystack.components.writers import DocumentWriter
+from haystack.document_stores.types import DuplicatePolicy
 from haystack_integrations.components.embedders.fastembed import (
     FastembedSparseDocumentEmbedder,
     FastembedSparseTextEmbedder,
@@ -12,24 +16,50 @@ from haystack_integrations.components.retrievers.qdrant import QdrantHybridRetri
 from haystack_integrations.document_stores.qdrant import QdrantDocumentStore
 
 from src.services.retrivers.doc_utils import (
+    ChunkFilter,
     DocumentCombiner,
-    DocumentReader,
     LinkFinder,
+    peak_rss_mb,
+    prefetch,
+    read_document,
 )
-from src.services.retrivers.embedder import DocEmbedder, EmbedClient, QueryEmbedder
+from src.services.retrivers.embedder import (
+    DocEmbedder,
+    EmbedClient,
+    HybridDocEmbedder,
+    HybridQueryEmbedder,
+    QueryEmbedder,
+)
+from src.services.retrivers.index_manifest import IndexManifest, file_hash
+from src.services.retrivers.retrieval_cache import RetrievalCache, bump_index_version
 from src.shared import config
+from src.shared.logger import CustomLogger
 
 
 class SavePipeline:
-    def __init__(self) -> None:
-        embed_client = EmbedClient()
-        document_embedder = DocEmbedder(embed_client=embed_client)
-        sparce_embedder = FastembedSparseDocumentEmbedder(model="Qdrant/bm25")
-        document_reader = DocumentReader()
-        document_store = QdrantDocumentStore(
+    def __init__(
+        self,
+        incremental: bool = False,
+        manifest_path: Path = Path(config.index_manifest_path),
+        batch_files: int = config.index_batch_files,
+    ) -> None:
+        self.logger = CustomLogger("save_pipeline")
+        self.batch_files = batch_files
+        # Смена модели, её бэкенда или разреженных векторов сбрасывает манифест
+        self.manifest = IndexManifest(
+            manifest_path,
+            signature=f"{config.embedding_model_name}:{config.embedding_model_dim}:"
+            f"{config.embedding_backend}:{config.sparse_backend}",
+        )
+        if not incremental:
+            self.manifest.reset()
+
+        self.embed_client = EmbedClient()
+        # Пустой манифест означает, что индекс строится с нуля
+        self.document_store = QdrantDocumentStore(
             url=config.db_server_url,
             embedding_dim=config.embedding_model_dim,
-            recreate_index=True,
+            recreate_index=self.manifest.is_empty(),
             use_sparse_embeddings=True,
             index="DataSplit",
         )
@@ -37,73 +67,235 @@ class SavePipeline:
             split_by="word", split_length=250, split_overlap=50
         )
         link_finder = LinkFinder()
-        document_writer = DocumentWriter(document_store=document_store)
+        chunk_filter = ChunkFilter()
+        document_writer = DocumentWriter(
+            document_store=self.document_store, policy=DuplicatePolicy.OVERWRITE
+        )
 
         indexing_pipeline = Pipeline()
-        indexing_pipeline.add_component("document_reader", document_reader)
-        indexing_pipeline.add_component("link_finder", link_finder)
         indexing_pipeline.add_component("document_splitter", document_splitter)
-        indexing_pipeline.add_component("document_embedder", document_embedder)
+        indexing_pipeline.add_component("link_finder", link_finder)
+        indexing_pipeline.add_component("chunk_filter", chunk_filter)
         indexing_pipeline.add_component("document_writer", document_writer)
-        indexing_pipeline.add_component("sparce_embedder", sparce_embedder)
 
-        indexing_pipeline.connect("document_reader.out", "document_splitter.documents")
         indexing_pipeline.connect("document_splitter", "link_finder.docs")
-        indexing_pipeline.connect("link_finder.out", "sparce_embedder")
-        indexing_pipeline.connect("sparce_embedder", "document_embedder")
+        indexing_pipeline.connect("link_finder.out", "chunk_filter.docs")
+        if config.sparse_backend == "server":
+            document_embedder = HybridDocEmbedder(embed_client=self.embed_client)
+            indexing_pipeline.add_component("document_embedder", document_embedder)
+            indexing_pipeline.connect("chunk_filter.out", "document_embedder")
+        else:
+            document_embedder = DocEmbedder(embed_client=self.embed_client)
+            sparce_embedder = FastembedSparseDocumentEmbedder(model="Qdrant/bm25")
+            indexing_pipeline.add_component("sparce_embedder", sparce_embedder)
+            indexing_pipeline.add_component("document_embedder", document_embedder)
+            indexing_pipeline.connect("chunk_filter.out", "sparce_embedder")
+            indexing_pipeline.connect("sparce_embedder", "document_embedder")
         indexing_pipeline.connect("document_embedder", "document_writer")
         self.pipeline = indexing_pipeline
 
+    def _iter_changed(
+        self, path_to_docs: Path, seen: Set[str]
+    ) -> Iterator[Tuple[Path, str, str]]:
+        for file_path in path_to_docs.rglob("*.*"):
+            if not file_path.is_file():
+                continue
+            source_path = file_path.relative_to(path_to_docs).as_posix()
+            seen.add(source_path)
+            digest = file_hash(file_path)
+            if self.manifest.file_hash(source_path) != digest:
+                yield file_path, source_path, digest
+
+    def _iter_batches(
+        self, changed: Iterator[Tuple[Path, str, str]]
+    ) -> Iterator[Tuple[List[Document], Dict[str, str]]]:
+        documents: List[Document] = []
+        digests: Dict[str, str] = {}
+        for file_path, source_path, digest in changed:
+            doc = read_document(file_path, source_path)
+            if doc is None:
+                continue
+            documents.append(doc)
+            digests[source_path] = digest
+            if len(documents) >= self.batch_files:
+                yield documents, digests
+                documents, digests = [], {}
+        if documents:
+            yield documents, digests
+
+    def _delete_chunks(self, chunk_ids: List[str]) -> None:
+        if chunk_ids:
+            self.document_store.delete_documents(chunk_ids)
+
+    def _index_batch(
+        self, documents: List[Document], digests: Dict[str, str]
+    ) -> Tuple[int, int]:
+        known_ids = self.manifest.known_chunk_ids(list(digests))
+        # Неизменённые чанки изменённого файла перезаписываются вместе с новыми:
+        # у них могли сдвинуться split_id и meta, векторы берутся из кэша
+        results = self.pipeline.run(
+            {"document_splitter": {"documents": documents}},
+            include_outputs_from={"chunk_filter"},
+        )
+        chunk_ids = results["chunk_filter"]["chunk_ids"]
+        written = len(results["chunk_filter"]["out"])
+
+        actual_ids = {i for ids in chunk_ids.values() for i in ids}
+        self._delete_chunks(sorted(known_ids - actual_ids))
+        for source_path, digest in digests.items():
+            self.manifest.update(source_path, digest, chunk_ids.get(source_path, []))
+        self.manifest.save()
+        return written, len(actual_ids - known_ids)
+
+    def _invalidate_retrieval_cache(self) -> None:
+        try:
+            version = bump_index_version(config.redis_url)
+            self.logger.info(f"Index version bumped to {version}")
+        except Exception as e:
+            self.logger.warn(
+                f"Failed to bump index version, retrieval cache may be stale: {e}"
+            )
+
     def run(self, path_to_docs: Path) -> None:
-        self.pipeline.run({"document_reader": {"source": path_to_docs}})
+        # Файлы читаются в фоновом потоке и проходят пайплайн батчами,
+        # поэтому в памяти одновременно находится не больше
+        # index_prefetch_batches + 1 батчей
+        seen: Set[str] = set()
+        batches = self._iter_batches(self._iter_changed(path_to_docs, seen))
+        run_started = time.perf_counter()
+        total_files = 0
+        total_chunks = 0
+        total_new = 0
+        # closing: при ошибке индексации поток чтения останавливается сразу,
+        # а не когда сборщик мусора доберётся до генератора
+        with closing(prefetch(batches, config.index_prefetch_batches)) as ready:
+            for batch_no, (documents, digests) in enumerate(ready, start=1):
+                batch_started = time.perf_counter()
+                written, new = self._index_batch(documents, digests)
+                elapsed = time.perf_counter() - batch_started
+                total_files += len(digests)
+                total_chunks += written
+                total_new += new
+                self.logger.info(
+                    f"Batch {batch_no}: {len(digests)} files, {written} chunks "
+                    f"({new} new) in {elapsed:.2f}s "
+                    f"({written / max(elapsed, 1e-9):.1f} chunks/s)"
+                )
+
+        removed = [p for p in self.manifest.files if p not in seen]
+        for source_path in removed:
+            self._delete_chunks(self.manifest.remove(source_path))
+        if removed:
+            self.manifest.save()
+        if total_chunks or removed:
+            self._invalidate_retrieval_cache()
+
+        elapsed = time.perf_counter() - run_started
+        self.logger.info(
+            f"Indexed {total_files} files, wrote {total_chunks} chunks "
+            f"({total_new} new), removed {len(removed)} files in {elapsed:.2f}s "
+            f"({total_chunks / max(elapsed, 1e-9):.1f} chunks/s), "
+            f"peak RSS {peak_rss_mb():.1f} MB"
+        )
+        self.logger.info(f"Embedding cache: {self.embed_client.cache_stats()}")
 
 
 class RetrievePipeline:
-    def __init__(self) -> None:
+    def __init__(self, cache: Optional[RetrievalCache] = None) -> None:
+        self.cache = cache
         document_store = QdrantDocumentStore(
             url=config.db_server_url,
             embedding_dim=config.embedding_model_dim,
             use_sparse_embeddings=True,
             index="DataSplit",
         )
-        retriever = QdrantHybridRetriever(
+        self.retriever = QdrantHybridRetriever(
             document_store=document_store, top_k=config.top_k
         )
-        sparse_embedder = FastembedSparseTextEmbedder(model="Qdrant/bm25")
-        embedder = QueryEmbedder(
-            embed_client=EmbedClient(),
+        self.combiner = DocumentCombiner()
+        self.hybrid = config.sparse_backend == "server"
+        if self.hybrid:
+            # Один запрос к серверу эмбеддингов вместо отдельной BM25 модели
+            self.embedder = HybridQueryEmbedder(embed_client=EmbedClient())
+            self.sparse_embedder = None
+        else:
+            self.embedder = QueryEmbedder(
+                embed_client=EmbedClient(),
+            )
+            self.sparse_embedder = FastembedSparseTextEmbedder(model="Qdrant/bm25")
+            self.sparse_embedder.warm_up()
+        # Плотный (HTTP) и разреженный эмбеддинги запроса независимы
+        # и считаются параллельно
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="retrieve"
         )
-        combiner = DocumentCombiner()
-        self.rag_pipeline = Pipeline()
-        self.rag_pipeline.add_component("sparse_text_embedder", sparse_embedder)
-        self.rag_pipeline.add_component("embedder", embedder)
-        self.rag_pipeline.add_component("retriever", retriever)
-        self.rag_pipeline.add_component("combiner", combiner)
-        self.rag_pipeline.connect(
-            "sparse_text_embedder.sparse_embedding", "retriever.query_sparse_embedding"
+
+    @staticmethod
+    def _timed(fn: Callable[[], Any]) -> Tuple[Any, float]:
+        started = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - started
+
+    def run(self, question: str) -> tuple[str, List[Document], Dict[str, float]]:
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        version = None
+        if self.cache is not None:
+            (cached, version), timings["cache"] = self._timed(
+                lambda: self.cache.lookup(question)
+            )
+            if cached is not None:
+                timings["total"] = time.perf_counter() - started
+                return cached[0], cached[1], timings
+
+        if self.hybrid:
+            embedded, timings["embed"] = self._timed(
+                lambda: self.embedder.run(query=question)
+            )
+            dense = embedded["embedding"]
+            sparse = embedded["sparse_embedding"]
+        else:
+            dense_future = self._executor.submit(
+                self._timed, lambda: self.embedder.run(query=question)
+            )
+            sparse_future = self._executor.submit(
+                self._timed, lambda: self.sparse_embedder.run(text=question)
+            )
+            (dense_out, timings["dense"]), (sparse_out, timings["sparse"]) = (
+                dense_future.result(),
+                sparse_future.result(),
+            )
+            timings["embed"] = time.perf_counter() - started
+            dense = dense_out["embedding"]
+            sparse = sparse_out["sparse_embedding"]
+
+        retrieved, timings["retrieve"] = self._timed(
+            lambda: self.retriever.run(
+                query_embedding=dense, query_sparse_embedding=sparse
+            )
         )
-        self.rag_pipeline.connect("embedder.embedding", "retriever.query_embedding")
-        self.rag_pipeline.connect("retriever", "combiner.documents")
-
-    def run(self, question: str) -> tuple[str, List[Document]]:
-        results = self.rag_pipeline.run(
-            {
-                "embedder": {"query": question},
-                "sparse_text_embedder": {"text": question},
-            }
+        combined, timings["combine"] = self._timed(
+            lambda: self.combiner.run(documents=retrieved["documents"])
         )
-        return results["combiner"]["out"], results["combiner"]["context"]
+        # Размер собранного контекста: сколько токенов ушло в промпт и сколько отброшено
+        timings.update(combined["stats"])
+        if self.cache is not None and version is not None:
+            self.cache.put(question, version, combined["out"], combined["context"])
+        timings["total"] = time.perf_counter() - started
+        return combined["out"], combined["context"], timings
 
 
 if __name__ == "__main__":
-    # Пример использования пайплайна для сохранения документов в базу
+    # Пример использования пайплайна для сохранения документов в базу.
+    # incremental=True переиндексирует только изменённые файлы и продолжает
+    # прерванный запуск с последнего сохранённого батча
     path_to_docs = Path("./data/document_links")
-    save_pipeline = SavePipeline()
+    save_pipeline = SavePipeline(incremental=True)
     save_pipeline.run(path_to_docs)
 
     # # Пример использования пайплайна для получения релевантных документов по вопросу
     # retrieve_pipeline = RetrievePipeline()
     # question = "Что произошло во Франции в 18 веке?"
-    # answer, docs = retrieve_pipeline.run(question)
+    # answer, docs, timings = retrieve_pipeline.run(question)
     # print("Ответ:", answer)
     # print(f"Найдено {len(docs)} релевантных документов.")
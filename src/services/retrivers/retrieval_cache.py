@@ -0,0 +1,113 @@
+import hashlib
+import json
+from typing import List, Optional, Tuple
+
+import redis
+from haystack import Document
+
+from src.shared.logger import CustomLogger
+from src.shared.normalization import normalize_text
+
+DEFAULT_PREFIX = "retrieval:"
+INDEX_VERSION_KEY = "retrieval:index_version"
+
+
+class RetrievalCache:
+    """
+    Shared cache of RetrievePipeline results keyed by the normalized query.
+
+    Every entry remembers the index version it was computed for; SavePipeline
+    bumps the version after re-indexing, so stale entries are never served and
+    simply expire by TTL.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        ttl: int,
+        prefix: str = DEFAULT_PREFIX,
+    ) -> None:
+        self.client = redis.from_url(redis_url, decode_responses=True)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.logger = CustomLogger("retrieval_cache")
+
+    def _key(self, normalized: str) -> str:
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"{self.prefix}query:{digest}"
+
+    @staticmethod
+    def _dump_document(doc: Document) -> dict:
+        data = doc.to_dict(flatten=False)
+        # Векторы не нужны для ответа и занимают большую часть записи
+        data.pop("embedding", None)
+        data.pop("sparse_embedding", None)
+        return data
+
+    def lookup(
+        self, question: str
+    ) -> Tuple[Optional[Tuple[str, List[Document]]], Optional[str]]:
+        """
+        Returns the cached result (or None) and the current index version.
+        The version must be passed to put(), so a result computed before a
+        re-index is not stored under the new version.
+        """
+        normalized = normalize_text(question)
+        if not normalized:
+            return None, None
+        key = self._key(normalized)
+        try:
+            version, raw = self.client.mget(INDEX_VERSION_KEY, key)
+        except redis.RedisError as e:
+            self.logger.warn(f"Retrieval cache unavailable: {e}")
+            return None, None
+        version = version or "0"
+        if raw is None:
+            return None, version
+        try:
+            entry = json.loads(raw)
+            if entry.get("version") != version:
+                return None, version
+            docs = [Document.from_dict(d) for d in entry["documents"]]
+            text = entry["text"]
+        except Exception as e:
+            # Битая или старого формата запись считается промахом и удаляется,
+            # иначе она ломала бы каждый такой запрос до истечения TTL
+            self.logger.warn(f"Dropping unreadable retrieval cache entry {key}: {e}")
+            try:
+                self.client.delete(key)
+            except redis.RedisError:
+                pass
+            return None, version
+        return (text, docs), version
+
+    def put(
+        self, question: str, version: str, text: str, documents: List[Document]
+    ) -> None:
+        normalized = normalize_text(question)
+        if not normalized:
+            return
+        entry = {
+            "version": version,
+            "text": text,
+            "documents": [self._dump_document(d) for d in documents],
+        }
+        try:
+            self.client.set(
+                self._key(normalized),
+                json.dumps(entry, ensure_ascii=False),
+                ex=self.ttl,
+            )
+        except redis.RedisError as e:
+            self.logger.warn(f"Retrieval cache unavailable: {e}")
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def bump_index_version(redis_url: str) -> int:
+    client = redis.from_url(redis_url, decode_responses=True)
+    try:
+        return client.incr(INDEX_VERSION_KEY)
+    finally:
+        client.close()
@@ -0,0 +1,176 @@
+import json
+import math
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.llm.prompts import RAG_NEED_TO_RETRIEVE
+from src.shared import config
+from src.shared.logger import CustomLogger
+from src.shared.normalization import normalize_text
+
+LABELS = ("skip", "retrieve")
+
+
+def gate_features(text: str) -> List[str]:
+    lemmas = normalize_text(text).split()
+    # Длина сообщения отделяет "привет"/"спасибо" от вопросов по закупкам
+    length = "short" if len(lemmas) <= 2 else "medium" if len(lemmas) <= 6 else "long"
+    features = lemmas + [f"__len_{length}"]
+    if "?" in text:
+        features.append("__question")
+    return features
+
+
+class NaiveBayesGate:
+    """Multinomial Naive Bayes over lemmas with add-one smoothing."""
+
+    def __init__(self) -> None:
+        self.doc_counts: Dict[str, int] = {label: 0 for label in LABELS}
+        self.token_counts: Dict[str, Dict[str, int]] = {label: {} for label in LABELS}
+        self.token_totals: Dict[str, int] = {label: 0 for label in LABELS}
+        self.vocabulary: set = set()
+
+    def train(self, samples: Iterable[Tuple[str, bool]]) -> "NaiveBayesGate":
+        for text, retrieve in samples:
+            label = LABELS[int(retrieve)]
+            self.doc_counts[label] += 1
+            counts = self.token_counts[label]
+            for feature, n in Counter(gate_features(text)).items():
+                counts[feature] = counts.get(feature, 0) + n
+                self.token_totals[label] += n
+                self.vocabulary.add(feature)
+        return self
+
+    def predict_proba(self, text: str) -> float:
+        """Probability that the message needs retrieval."""
+        total_docs = sum(self.doc_counts.values())
+        if not total_docs:
+            return 1.0
+        features = gate_features(text)
+        vocab = len(self.vocabulary) + 1
+        scores = {}
+        for label in LABELS:
+            score = math.log((self.doc_counts[label] + 1) / (total_docs + len(LABELS)))
+            counts = self.token_counts[label]
+            denominator = self.token_totals[label] + vocab
+            for feature in features:
+                score += math.log((counts.get(feature, 0) + 1) / denominator)
+            scores[label] = score
+        diff = scores["skip"] - scores["retrieve"]
+        if diff > 50:
+            return 0.0
+        return 1.0 / (1.0 + math.exp(diff))
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "doc_counts": self.doc_counts,
+                    "token_counts": self.token_counts,
+                    "token_totals": self.token_totals,
+                },
+                file,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "NaiveBayesGate":
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        model = cls()
+        model.doc_counts = data["doc_counts"]
+        model.token_counts = data["token_counts"]
+        model.token_totals = data["token_totals"]
+        model.vocabulary = {
+            feature for counts in model.token_counts.values() for feature in counts
+        }
+        return model
+
+
+def load_labels(path: Path) -> List[Tuple[str, bool]]:
+    samples: List[Tuple[str, bool]] = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                samples.append((item["text"], bool(item["retrieve"])))
+    return samples
+
+
+def parse_yes_no(reply: str) -> Optional[bool]:
+    # Решает только первое слово ответа: "НЕТ, ДАННЫЕ НЕ НУЖНЫ" - это нет
+    words = re.findall(r"\w+", reply.upper())
+    if not words:
+        return None
+    return {"ДА": True, "НЕТ": False}.get(words[0])
+
+
+def llm_needs_retrieval(
+    client: object, message: str, context: str = ""
+) -> Optional[bool]:
+    """LLM verdict on the message; None when the reply is neither ДА nor НЕТ."""
+    messages = []
+    if context:
+        messages.append({"role": "system", "content": context})
+    messages += [
+        {"role": "system", "content": RAG_NEED_TO_RETRIEVE},
+        {"role": "user", "content": message},
+    ]
+    return parse_yes_no(client.generate(messages))
+
+
+class RetrievalGate:
+    """
+    Decides before retrieval whether the message needs documents. Confident
+    classifier scores decide alone, the uncertain band goes to the LLM when a
+    client is given and to retrieval otherwise.
+    """
+
+    def __init__(
+        self,
+        model_path: Path = Path(config.retrieval_gate_model_path),
+        skip_below: float = config.retrieval_gate_skip_below,
+        retrieve_above: float = config.retrieval_gate_retrieve_above,
+        llm_client: Optional[object] = None,
+    ) -> None:
+        self.logger = CustomLogger("retrieval_gate")
+        self.skip_below = skip_below
+        self.retrieve_above = retrieve_above
+        self.llm_client = llm_client
+        self.model: Optional[NaiveBayesGate] = None
+        if Path(model_path).exists():
+            self.model = NaiveBayesGate.load(model_path)
+        else:
+            self.logger.warn(f"No gate model at {model_path}, retrieval always runs")
+
+    def decide(self, message: str, context: str = "") -> bool:
+        started = time.perf_counter()
+        proba = self.model.predict_proba(message) if self.model is not None else 1.0
+        if self.model is None:
+            need, source = True, "no_model"
+        elif proba >= self.retrieve_above:
+            need, source = True, "classifier"
+        elif proba <= self.skip_below:
+            need, source = False, "classifier"
+        elif self.llm_client is not None:
+            try:
+                verdict = llm_needs_retrieval(self.llm_client, message, context)
+            except Exception as e:
+                self.logger.warn(f"LLM gate failed, retrieving: {e}")
+                verdict = None
+            if verdict is None:
+                need, source = True, "fallback"
+            else:
+                need, source = verdict, "llm"
+        else:
+            need, source = True, "uncertain"
+        self.logger.info(
+            f"Retrieval gate: retrieve={need} p={proba:.3f} source={source} "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms, message: {message!r}"
+        )
+        return need
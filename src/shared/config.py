@@ -7,11 +7,50 @@ load_dotenv()
 server_ip = os.getenv("EMBEDDING_SERVER_IP", "localhost")
 
 top_k = 5
+# Бюджет контекста из найденных документов в токенах модели генерации
+context_max_tokens = 3000
 max_tokens = 2048
 temperature = 0.7
 model_name = "Qwen/Qwen3-8B"
+embedding_model_name = "BAAI/bge-m3"
 embedding_model_dim = 384
 embedding_server_url = f"http://{server_ip}:1235/embed"
+embedding_hybrid_server_url = f"http://{server_ip}:1235/embed_hybrid"
+# Бэкенд сервера эмбеддингов (torch/int8/onnx, тот же EMBED_BACKEND, что у
+# run_servers/embed): векторы бэкендов немного различаются и не смешиваются в кэше
+embedding_backend = os.getenv("EMBED_BACKEND", "torch")
+# "fastembed" - BM25 в процессе, "server" - лексические веса bge-m3 с сервера
+# эмбеддингов. Смена значения требует полной переиндексации
+sparse_backend = "fastembed"
+embed_batch_size = 64
+embed_max_batch_chars = 32000
+embed_max_in_flight = 4
+embed_wire_format = "float32"
+embed_cache_enabled = True
+embed_cache_path = "data/cache/embeddings.sqlite"
+embed_cache_max_bytes = 2 * 1024**3
+embed_cache_lru_size = 50000
 llm_server_url = f"http://{server_ip}:1234/v1"
 db_server_url = f"http://{server_ip}:6333"
 llm_api_key = "dal_jazzu"
+lemma_cache_size = 100000
+# Единственный адрес Redis: история чатов, кэш поиска и версия индекса должны
+# жить в одной базе, иначе переиндексация не сбросит кэш. Его же берёт gateway
+redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+retrieval_cache_enabled = True
+retrieval_cache_ttl = 60 * 60 * 24
+# Классификатор перед поиском: ниже skip_below поиск пропускается, выше
+# retrieve_above выполняется, между ними решает LLM (если включено) или поиск
+retrieval_gate_enabled = True
+retrieval_gate_model_path = "data/retrieval_gate.json"
+retrieval_gate_skip_below = 0.2
+retrieval_gate_retrieve_above = 0.8
+retrieval_gate_llm_fallback = False
+# Семантический кэш ответов на первые вопросы диалога, по умолчанию выключен
+answer_cache_enabled = False
+answer_cache_collection = "answer_cache"
+answer_cache_threshold = 0.95
+answer_cache_ttl = 60 * 60 * 24 * 7
+index_manifest_path = "data/index_manifest.json"
+index_batch_files = 64
+index_prefetch_batches = 2
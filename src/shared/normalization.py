@@ -0,0 +1,65 @@
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import pymorphy3
+
+from src.shared import config
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=None)
+def get_morph() -> pymorphy3.MorphAnalyzer:
+    # Один анализатор на процесс: словари pymorphy3 занимают десятки мегабайт
+    return pymorphy3.MorphAnalyzer()
+
+
+@lru_cache(maxsize=config.lemma_cache_size)
+def lemmatize(token: str) -> str:
+    # Словарь закупочной тематики небольшой, большинство токенов берётся из кэша
+    try:
+        return get_morph().parse(token)[0].normal_form
+    except Exception:
+        return token
+
+
+def normalize_text(text: str) -> str:
+    if not text:
+        return ""
+    return " ".join(lemmatize(t) for t in _TOKEN_RE.findall(text.lower()))
+
+
+def normalize_texts(
+    texts: Iterable[str],
+    workers: int = 0,
+    chunksize: int = 256,
+    pool: Optional[Executor] = None,
+) -> List[str]:
+    """
+    Normalizes many texts in one call. Large batches go to `pool` if given,
+    otherwise workers > 1 starts a process pool for this call (for bulk jobs;
+    each process keeps its own lemma cache). Jobs that call this repeatedly
+    should pass one pool so workers and their caches survive between calls.
+    """
+    texts = list(texts)
+    if len(texts) > chunksize:
+        if pool is not None:
+            return list(pool.map(normalize_text, texts, chunksize=chunksize))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as own_pool:
+                return list(own_pool.map(normalize_text, texts, chunksize=chunksize))
+    return [normalize_text(text) for text in texts]
+
+
+def cache_info() -> Dict[str, float]:
+    info = lemmatize.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": info.hits / lookups if lookups else 0.0,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+    }
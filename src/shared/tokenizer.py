@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+from transformers import AutoTokenizer
+
+from src.shared import config
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str = config.model_name) -> AutoTokenizer:
+    # Загрузка токенизатора занимает сотни миллисекунд, поэтому один на процесс
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text, add_special_tokens=False))
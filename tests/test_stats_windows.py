@@ -0,0 +1,33 @@
+import pytest
+
+from src.services.db.redis_chat_db import STATS_WINDOWS, window_keys
+
+STATS_KEY = "chat:stats:questions"
+# 2026-04-21 10:05 UTC: пять минут после смены часа
+NOW = 493546 * 3600 + 5 * 60
+
+
+def test_all_time_uses_only_the_stats_key() -> None:
+    assert window_keys(STATS_KEY, None, NOW) == [STATS_KEY]
+
+
+def test_one_hour_window_includes_the_previous_bucket() -> None:
+    assert window_keys(STATS_KEY, "1h", NOW) == [
+        f"{STATS_KEY}:w:1h:493546",
+        f"{STATS_KEY}:h:493546",
+        f"{STATS_KEY}:h:493545",
+    ]
+
+
+@pytest.mark.parametrize("window", sorted(STATS_WINDOWS))
+def test_window_covers_now_minus_window(window: str) -> None:
+    hours = STATS_WINDOWS[window]
+    buckets = window_keys(STATS_KEY, window, NOW)[1:]
+    assert len(buckets) == hours + 1
+    oldest = int((NOW - hours * 3600) // 3600)
+    assert buckets[-1] == f"{STATS_KEY}:h:{oldest}"
+
+
+def test_unknown_window_is_rejected() -> None:
+    with pytest.raises(ValueError):
+        window_keys(STATS_KEY, "30d", NOW)